@@ -0,0 +1,29 @@
+"""Add composite indexes for audit log filters and pending CR lookups
+
+Revision ID: 003
+Revises: 002
+Create Date: 2025-02-01 00:00:00.000000
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "003"
+down_revision: Union[str, None] = "002"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_audit_logs_action_created", "audit_logs", ["action", sa.text("created_at DESC")])
+    op.create_index("ix_audit_logs_rtype_created", "audit_logs", ["resource_type", sa.text("created_at DESC")])
+    # Superseded by the (action, created_at) index, which shares its prefix
+    op.drop_index("ix_audit_logs_action", table_name="audit_logs")
+    op.create_index("ix_change_requests_status_created", "change_requests", ["status", sa.text("created_at DESC")])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_change_requests_status_created", table_name="change_requests")
+    op.create_index("ix_audit_logs_action", "audit_logs", ["action"])
+    op.drop_index("ix_audit_logs_rtype_created", table_name="audit_logs")
+    op.drop_index("ix_audit_logs_action_created", table_name="audit_logs")
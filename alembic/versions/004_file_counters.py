@@ -0,0 +1,54 @@
+"""Add file_counters table maintained by a trigger on file_versions
+
+Revision ID: 004
+Revises: 003
+Create Date: 2025-02-08 00:00:00.000000
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "004"
+down_revision: Union[str, None] = "003"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_table(
+        "file_counters",
+        sa.Column("name", sa.String(50), nullable=False),
+        sa.Column("value", sa.BigInteger(), server_default="0", nullable=False),
+        sa.PrimaryKeyConstraint("name"),
+    )
+    op.execute(
+        "INSERT INTO file_counters (name, value) "
+        "SELECT 'files_total', count(DISTINCT file_path) FROM file_versions WHERE is_delete = false"
+    )
+    # files_total counts paths with at least one non-delete version, so it
+    # only moves when such a version is recorded for a path for the first time.
+    op.execute("""
+        CREATE FUNCTION file_versions_count_files() RETURNS trigger AS $$
+        BEGIN
+            IF NOT EXISTS (
+                SELECT 1 FROM file_versions
+                WHERE file_path = NEW.file_path AND is_delete = false AND id <> NEW.id
+            ) THEN
+                UPDATE file_counters SET value = value + 1 WHERE name = 'files_total';
+            END IF;
+            RETURN NULL;
+        END;
+        $$ LANGUAGE plpgsql
+    """)
+    op.execute("""
+        CREATE TRIGGER trg_file_versions_count_files
+        AFTER INSERT ON file_versions
+        FOR EACH ROW WHEN (NEW.is_delete = false)
+        EXECUTE FUNCTION file_versions_count_files()
+    """)
+
+
+def downgrade() -> None:
+    op.execute("DROP TRIGGER IF EXISTS trg_file_versions_count_files ON file_versions")
+    op.execute("DROP FUNCTION IF EXISTS file_versions_count_files()")
+    op.drop_table("file_counters")
@@ -0,0 +1,24 @@
+"""Add composite indexes backing the change request list filters
+
+Revision ID: 005
+Revises: 004
+Create Date: 2025-02-15 00:00:00.000000
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "005"
+down_revision: Union[str, None] = "004"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_change_requests_status_updated", "change_requests", ["status", sa.text("updated_at DESC")])
+    op.create_index("ix_change_requests_author_updated", "change_requests", ["author_id", sa.text("updated_at DESC")])
+
+
+def downgrade() -> None:
+    op.drop_index("ix_change_requests_author_updated", table_name="change_requests")
+    op.drop_index("ix_change_requests_status_updated", table_name="change_requests")
@@ -0,0 +1,29 @@
+"""Add indexes for DISTINCT ON latest-version lookups and path search
+
+Revision ID: 006
+Revises: 005
+Create Date: 2025-02-22 00:00:00.000000
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "006"
+down_revision: Union[str, None] = "005"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.create_index("ix_file_versions_path_version_desc", "file_versions", ["file_path", sa.text("version DESC")])
+    # Substring search (ILIKE '%q%') cannot use a btree; trigrams make it sub-linear
+    op.execute("CREATE EXTENSION IF NOT EXISTS pg_trgm")
+    op.create_index(
+        "ix_file_versions_path_trgm", "file_versions", ["file_path"],
+        postgresql_using="gin", postgresql_ops={"file_path": "gin_trgm_ops"},
+    )
+
+
+def downgrade() -> None:
+    op.drop_index("ix_file_versions_path_trgm", table_name="file_versions")
+    op.drop_index("ix_file_versions_path_version_desc", table_name="file_versions")
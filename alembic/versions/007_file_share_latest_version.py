@@ -0,0 +1,40 @@
+"""Denormalize latest-version state onto file_shares
+
+Revision ID: 007
+Revises: 006
+Create Date: 2025-03-01 00:00:00.000000
+"""
+from typing import Sequence, Union
+from alembic import op
+import sqlalchemy as sa
+
+revision: str = "007"
+down_revision: Union[str, None] = "006"
+branch_labels: Union[str, Sequence[str], None] = None
+depends_on: Union[str, Sequence[str], None] = None
+
+
+def upgrade() -> None:
+    op.add_column(
+        "file_shares",
+        sa.Column("latest_version_id", sa.Integer(), sa.ForeignKey("file_versions.id"), nullable=True),
+    )
+    op.add_column(
+        "file_shares",
+        sa.Column("is_tombstoned", sa.Boolean(), server_default=sa.text("false"), nullable=False),
+    )
+    op.execute("""
+        UPDATE file_shares s
+        SET latest_version_id = v.id, is_tombstoned = v.is_delete
+        FROM (
+            SELECT DISTINCT ON (file_path) id, file_path, is_delete
+            FROM file_versions
+            ORDER BY file_path, version DESC
+        ) v
+        WHERE v.file_path = s.file_path
+    """)
+
+
+def downgrade() -> None:
+    op.drop_column("file_shares", "is_tombstoned")
+    op.drop_column("file_shares", "latest_version_id")
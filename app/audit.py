@@ -0,0 +1,116 @@
+"""Buffered audit logging.
+
+Audit rows are queued in-process and written to Postgres in batches via
+COPY by a background task, keeping the INSERT off the request path.
+Delivery is at-most-once: rows still queued when a worker dies are lost.
+
+Request handlers use log_after_commit(), which holds the row on the
+session until its transaction commits, so a request that fails or rolls
+back never records an event that did not happen.
+"""
+
+import asyncio
+import json
+import logging
+from typing import Optional
+
+from sqlalchemy import event
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.database import engine
+from app.models import AuditLog, utcnow
+
+logger = logging.getLogger("vault.audit")
+
+COLUMNS = ["user_id", "action", "resource_type", "resource_id", "details", "ip_address", "created_at"]
+
+_PENDING_KEY = "pending_audit_logs"
+
+
+class AuditLogBuffer:
+    """Collects AuditLog rows and flushes them in batches with COPY."""
+
+    def __init__(self, max_batch: int = 1000, max_delay: float = 1.0):
+        self.max_batch = max_batch
+        self.max_delay = max_delay
+        self._queue: asyncio.Queue[tuple] = asyncio.Queue()
+        self._task: Optional[asyncio.Task] = None
+
+    def put(self, entry: AuditLog) -> None:
+        # COPY bypasses column defaults, so apply them here the way an ORM
+        # INSERT would: only for attributes that were never set, keeping an
+        # explicit None as NULL. The timestamp is that of the event, not the flush.
+        values = entry.__dict__
+        self._queue.put_nowait((
+            entry.user_id,
+            entry.action,
+            entry.resource_type,
+            values.get("resource_id", ""),
+            json.dumps(values.get("details", {})),
+            values.get("ip_address", ""),
+            entry.created_at or utcnow(),
+        ))
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        # Flush whatever is still queued
+        batch = []
+        while not self._queue.empty():
+            batch.append(self._queue.get_nowait())
+        if batch:
+            await self._write(batch)
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await self._queue.get()]
+            deadline = loop.time() + self.max_delay
+            while len(batch) < self.max_batch:
+                timeout = deadline - loop.time()
+                if timeout <= 0:
+                    break
+                try:
+                    batch.append(await asyncio.wait_for(self._queue.get(), timeout))
+                except asyncio.TimeoutError:
+                    break
+            await self._write(batch)
+
+    async def _write(self, rows: list[tuple]) -> None:
+        try:
+            async with engine.begin() as conn:
+                raw = await conn.get_raw_connection()
+                await raw.driver_connection.copy_records_to_table(
+                    AuditLog.__tablename__, records=rows, columns=COLUMNS,
+                )
+        except Exception:
+            logger.exception("Dropped %d audit log rows", len(rows))
+
+
+audit_buffer = AuditLogBuffer()
+
+
+def log_after_commit(db: AsyncSession, entry: AuditLog) -> None:
+    """Queue `entry` once `db` commits; it is discarded if the transaction rolls back."""
+    db.sync_session.info.setdefault(_PENDING_KEY, []).append(entry)
+
+
+@event.listens_for(Session, "after_commit")
+def _queue_committed(session: Session) -> None:
+    for entry in session.info.pop(_PENDING_KEY, ()):
+        audit_buffer.put(entry)
+
+
+@event.listens_for(Session, "after_soft_rollback")
+def _drop_rolled_back(session: Session, previous_transaction) -> None:
+    session.info.pop(_PENDING_KEY, None)
@@ -1,27 +1,135 @@
 """Authentication utilities: password hashing and JWT tokens."""
 
+import asyncio
+import hashlib
+import hmac
+import os
+import secrets
+import time
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime, timedelta, timezone
+from functools import lru_cache
 from typing import Optional
 
 import bcrypt
 import jwt
+from argon2 import PasswordHasher
+from argon2.exceptions import InvalidHashError, VerificationError
+from cachetools import LRUCache, TTLCache
+from cryptography.hazmat.primitives import serialization
+from cryptography.hazmat.primitives.asymmetric.ed25519 import Ed25519PrivateKey
 from fastapi import Depends, HTTPException, Request, status
-from sqlalchemy import select
+from sqlalchemy import bindparam, inspect, select
 from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import make_transient_to_detached
 
-from app.config import get_settings
+from app.config import settings
 from app.database import get_db
 from app.models import User
 
-settings = get_settings()
+_hasher = PasswordHasher(time_cost=2, memory_cost=65536, parallelism=2)
+
+# Password KDFs get their own pool so a login burst cannot starve the default
+# executor that S3 and diff work run on.
+_kdf_executor = ThreadPoolExecutor(max_workers=os.cpu_count() or 1, thread_name_prefix="kdf")
+
+# Verified against when a login names an unknown user, so the response time
+# does not reveal whether the account exists.
+DUMMY_PASSWORD_HASH = _hasher.hash(secrets.token_hex(16))
+
+# Recent verification results keyed by HMAC(secret, password|hash), so the
+# plaintext never sits in memory and repeat logins skip the KDF.
+_verify_cache: LRUCache = LRUCache(maxsize=1024)
+# Keyed once at import; copy() per call skips re-deriving the HMAC pads.
+_verify_mac = hmac.new(settings.secret_key.encode("utf-8"), digestmod="sha256")
+
+
+def _load_jwt_keys() -> tuple:
+    """Return (signing_key, verifying_key) for the configured JWT algorithm."""
+    if settings.jwt_algorithm != "EdDSA":
+        return settings.secret_key, settings.secret_key
+    if bool(settings.jwt_private_key) != bool(settings.jwt_public_key):
+        # With only one side configured, signing and verification would use
+        # unrelated keys and reject every token; refuse to start instead
+        raise RuntimeError("Set both JWT_PRIVATE_KEY and JWT_PUBLIC_KEY, or neither")
+    if not settings.jwt_private_key:
+        # Derive a stable key so every worker agrees without extra configuration
+        seed = hashlib.sha256(b"jwt-ed25519|" + settings.secret_key.encode("utf-8")).digest()
+        private_key = Ed25519PrivateKey.from_private_bytes(seed)
+        return private_key, private_key.public_key()
+    private_key = serialization.load_pem_private_key(settings.jwt_private_key.encode("utf-8"), password=None)
+    public_key = serialization.load_pem_public_key(settings.jwt_public_key.encode("utf-8"))
+    raw = (serialization.Encoding.Raw, serialization.PublicFormat.Raw)
+    if private_key.public_key().public_bytes(*raw) != public_key.public_bytes(*raw):
+        raise RuntimeError("JWT_PUBLIC_KEY does not match JWT_PRIVATE_KEY")
+    return private_key, public_key
+
+
+# Parsed once at import so PyJWT does not re-load key material per call
+_JWT_SIGNING_KEY, _JWT_VERIFY_KEY = _load_jwt_keys()
+
+# Decoded JWT payloads keyed by sha256(token) -> (valid_until, payload).
+# Entries live at most 60 s and never past the token's own expiry.
+_TOKEN_CACHE: LRUCache = LRUCache(maxsize=10_000)
+_TOKEN_CACHE_TTL = 60
+
+# Active users by id, so back-to-back requests skip the SELECT. Kept short
+# because invalidation below only reaches the current worker process.
+# Entries are immutable tuples of column values, never ORM instances: an
+# instance belongs to one request's session, and that session's rollback
+# would expire it for every later request holding it.
+_user_cache: TTLCache = TTLCache(maxsize=1024, ttl=5)
+_USER_COLUMNS = tuple(attr.key for attr in inspect(User).column_attrs)
+
+# Built once so SQLAlchemy's compiled cache is reused across requests
+_ACTIVE_USER_STMT = select(User).where(User.id == bindparam("uid"), User.is_active == True)
+
+
+def _is_bcrypt_hash(hashed: str) -> bool:
+    return hashed.startswith(("$2a$", "$2b$", "$2y$"))
+
+
+def _check_password(password: bytes, hashed: str) -> bool:
+    if _is_bcrypt_hash(hashed):
+        # Legacy hashes from before the switch to Argon2id
+        return bcrypt.checkpw(password, hashed.encode("utf-8"))
+    try:
+        return _hasher.verify(hashed, password)
+    except (VerificationError, InvalidHashError):
+        return False
+
+
+async def hash_password(password: str) -> str:
+    # Argon2id is deliberately slow; run it off the event loop.
+    return await asyncio.get_running_loop().run_in_executor(_kdf_executor, _hasher.hash, password)
+
+
+async def verify_password(password: str, hashed: str) -> bool:
+    password_bytes = password.encode("utf-8")
+    mac = _verify_mac.copy()
+    mac.update(password_bytes + b"|" + hashed.encode("utf-8"))
+    key = mac.digest()
+    if _verify_cache.get(key):
+        return True
+    ok = await asyncio.get_running_loop().run_in_executor(_kdf_executor, _check_password, password_bytes, hashed)
+    # Only successful checks are remembered so failed guesses always pay the KDF.
+    if ok:
+        _verify_cache[key] = True
+    return ok
+
 
+def shutdown_kdf_executor() -> None:
+    _kdf_executor.shutdown(wait=False, cancel_futures=True)
 
-def hash_password(password: str) -> str:
-    return bcrypt.hashpw(password.encode("utf-8"), bcrypt.gensalt()).decode("utf-8")
 
+def constant_time_eq(a: str, b: str) -> bool:
+    """Compare secrets (e.g. share tokens) without leaking timing information."""
+    return hmac.compare_digest(a.encode("utf-8"), b.encode("utf-8"))
 
-def verify_password(password: str, hashed: str) -> bool:
-    return bcrypt.checkpw(password.encode("utf-8"), hashed.encode("utf-8"))
+
+def password_needs_rehash(hashed: str) -> bool:
+    """True for legacy bcrypt hashes or Argon2 hashes with outdated parameters."""
+    return _is_bcrypt_hash(hashed) or _hasher.check_needs_rehash(hashed)
 
 
 def create_access_token(user_id: int, username: str) -> str:
@@ -31,12 +139,19 @@ def create_access_token(user_id: int, username: str) -> str:
         "exp": datetime.now(timezone.utc) + timedelta(minutes=settings.access_token_expire_minutes),
         "iat": datetime.now(timezone.utc),
     }
-    return jwt.encode(payload, settings.secret_key, algorithm=settings.jwt_algorithm)
+    return jwt.encode(payload, _JWT_SIGNING_KEY, algorithm=settings.jwt_algorithm)
 
 
 def decode_access_token(token: str) -> dict:
+    key = hashlib.sha256(token.encode("utf-8")).digest()
+    now = time.time()
+    cached = _TOKEN_CACHE.get(key)
+    if cached is not None and now < cached[0]:
+        return cached[1]
     try:
-        return jwt.decode(token, settings.secret_key, algorithms=[settings.jwt_algorithm])
+        payload = jwt.decode(token, _JWT_VERIFY_KEY, algorithms=[settings.jwt_algorithm])
+        _TOKEN_CACHE[key] = (min(payload["exp"], now + _TOKEN_CACHE_TTL), payload)
+        return payload
     except jwt.ExpiredSignatureError:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Token expired")
     except jwt.InvalidTokenError:
@@ -55,36 +170,75 @@ def get_token_from_request(request: Request) -> Optional[str]:
     return None
 
 
+async def _load_active_user(db: AsyncSession, user_id: int) -> Optional[User]:
+    snapshot = _user_cache.get(user_id)
+    if snapshot is not None:
+        # Rebuild a fresh instance and attach it to this session without a SELECT
+        user = User(**dict(zip(_USER_COLUMNS, snapshot)))
+        make_transient_to_detached(user)
+        return await db.merge(user, load=False)
+    result = await db.execute(_ACTIVE_USER_STMT, {"uid": user_id})
+    user = result.scalar_one_or_none()
+    if user is not None:
+        _user_cache[user_id] = tuple(getattr(user, key) for key in _USER_COLUMNS)
+    return user
+
+
+def invalidate_user_cache(user_id: int) -> None:
+    """Drop a cached user after its role, status or password changes."""
+    _user_cache.pop(user_id, None)
+
+
+def forget_token(token: str) -> None:
+    """Drop a token and its user from the in-process caches (used on logout)."""
+    cached = _TOKEN_CACHE.pop(hashlib.sha256(token.encode("utf-8")).digest(), None)
+    if cached is not None:
+        invalidate_user_cache(int(cached[1]["sub"]))
+
+
 async def get_current_user(request: Request, db: AsyncSession = Depends(get_db)) -> User:
+    user = getattr(request.state, "user", None)
+    if user is not None:
+        return user
     token = get_token_from_request(request)
     if not token:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Not authenticated")
     payload = decode_access_token(token)
-    user_id = int(payload["sub"])
-    result = await db.execute(select(User).where(User.id == user_id, User.is_active == True))
-    user = result.scalar_one_or_none()
+    user = await _load_active_user(db, int(payload["sub"]))
     if not user:
         raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="User not found or inactive")
+    request.state.user = user
     return user
 
 
 async def get_optional_user(request: Request, db: AsyncSession = Depends(get_db)) -> Optional[User]:
+    user = getattr(request.state, "user", None)
+    if user is not None:
+        return user
     token = get_token_from_request(request)
     if not token:
         return None
     try:
         payload = decode_access_token(token)
-        user_id = int(payload["sub"])
-        result = await db.execute(select(User).where(User.id == user_id, User.is_active == True))
-        return result.scalar_one_or_none()
+        user = await _load_active_user(db, int(payload["sub"]))
     except HTTPException:
         return None
+    if user is not None:
+        request.state.user = user
+    return user
 
 
 def require_role(*roles: str):
     """Dependency that checks if the current user has one of the required roles."""
+    return _role_checker(frozenset(roles))
+
+
+@lru_cache(maxsize=None)
+def _role_checker(allowed: frozenset):
+    # One checker per role set, so FastAPI sees the same dependency callable
+    # everywhere and can de-duplicate it within a request.
     async def checker(user: User = Depends(get_current_user)):
-        if user.role not in roles:
+        if user.role not in allowed:
             raise HTTPException(status_code=status.HTTP_403_FORBIDDEN, detail="Insufficient permissions")
         return user
     return checker
@@ -1,18 +1,54 @@
 """Database engine and session management."""
 
+import asyncio
+import logging
+import uuid
+
+from fastapi import Depends
 from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import DeclarativeBase
+from sqlalchemy.pool import NullPool
+
+from app.config import settings
 
-from app.config import get_settings
+logger = logging.getLogger("vault.db")
 
-settings = get_settings()
+connect_args = {}
+if settings.database_url.startswith("postgresql+asyncpg"):
+    # The queries here are short OLTP lookups; JIT compilation only adds latency
+    connect_args["server_settings"] = {"jit": "off"}
+    if settings.db_pgbouncer:
+        # Transaction pooling hands each transaction a different server
+        # connection, so named prepared statements cannot be cached or reused
+        connect_args.update(
+            statement_cache_size=0,
+            prepared_statement_cache_size=0,
+            prepared_statement_name_func=lambda: f"__asyncpg_{uuid.uuid4()}__",
+        )
+    else:
+        # Keep server-side prepared statements around so repeated queries skip parse/plan
+        connect_args.update(statement_cache_size=1024, prepared_statement_cache_size=256)
+
+if settings.db_pgbouncer:
+    # PgBouncer owns the pool; holding connections here would only pin server slots
+    pool_args = {"poolclass": NullPool}
+else:
+    pool_args = {
+        # No per-checkout ping; keep_pool_warm() and pool_recycle handle staleness
+        "pool_pre_ping": settings.db_pool_pre_ping,
+        "pool_recycle": settings.db_pool_recycle,
+        "pool_size": settings.db_pool_size,
+        "max_overflow": settings.db_max_overflow,
+        # Fail fast when the pool is exhausted rather than queueing for 30 s
+        "pool_timeout": settings.db_pool_timeout,
+    }
 
 engine = create_async_engine(
     settings.database_url,
     echo=settings.debug,
-    pool_pre_ping=True,
-    pool_size=10,
-    max_overflow=20,
+    query_cache_size=1200,
+    connect_args=connect_args,
+    **pool_args,
 )
 
 async_session = async_sessionmaker(engine, class_=AsyncSession, expire_on_commit=False)
@@ -32,6 +68,67 @@ async def get_db() -> AsyncSession:
             raise
 
 
+class ReadOnlySnapshot:
+    """The request's session, reading from one REPEATABLE READ, READ ONLY snapshot.
+
+    The snapshot transaction starts on the first execute(), so a handler
+    that answers from a cache never touches the database.
+    """
+
+    def __init__(self, session: AsyncSession):
+        self.session = session
+        self._started = False
+
+    async def execute(self, *args, **kwargs):
+        if not self._started:
+            # End whatever auth read in the default transaction; isolation can
+            # only be chosen when the next one begins.
+            await self.session.commit()
+            await self.session.connection(execution_options={
+                "isolation_level": "REPEATABLE READ",
+                "postgresql_readonly": True,
+            })
+            self._started = True
+        return await self.session.execute(*args, **kwargs)
+
+
+async def get_read_only_db(db: AsyncSession = Depends(get_db)) -> ReadOnlySnapshot:
+    """Read-only snapshot over the request's own session (no second pooled connection)."""
+    return ReadOnlySnapshot(db)
+
+
+async def warm_pool():
+    """Open pool_size connections up front so early requests skip the handshake."""
+    pool = engine.sync_engine.pool
+    size = pool.size() if hasattr(pool, "size") else 0
+    conns = await asyncio.gather(*(engine.connect() for _ in range(size)), return_exceptions=True)
+    for conn in conns:
+        if isinstance(conn, Exception):
+            logger.warning("Could not pre-open pooled connection: %s", conn)
+        else:
+            await conn.close()
+
+
+async def _ping_connection():
+    try:
+        async with engine.connect() as conn:
+            await conn.exec_driver_sql("SELECT 1")
+    except Exception as e:
+        # A failed ping invalidates the connection, so the pool replaces it
+        logger.debug("Pool keepalive ping failed: %s", e)
+
+
+async def keep_pool_warm(interval: float = 60.0):
+    """Periodically touch every idle pooled connection so none go stale unnoticed."""
+    pool = engine.sync_engine.pool
+    while True:
+        await asyncio.sleep(interval)
+        idle = pool.checkedin() if hasattr(pool, "checkedin") else 0
+        if idle:
+            # Holding them all at once makes the pool hand out each idle one
+            await asyncio.gather(*(_ping_connection() for _ in range(idle)))
+
+
 async def init_db():
     async with engine.begin() as conn:
         await conn.run_sync(Base.metadata.create_all)
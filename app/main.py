@@ -1,19 +1,23 @@
 """FastAPI application entry point."""
 
+import asyncio
 import logging
+import os
+from concurrent.futures import ThreadPoolExecutor
 from contextlib import asynccontextmanager
 
 from fastapi import FastAPI, Request
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, ORJSONResponse
 from fastapi.staticfiles import StaticFiles
+from sqlalchemy.exc import TimeoutError as PoolTimeoutError
 from starlette.middleware.sessions import SessionMiddleware
 
-from app.config import get_settings, STATIC_DIR
-from app.database import init_db, close_db
+from app.audit import audit_buffer
+from app.auth import shutdown_kdf_executor
+from app.config import settings, STATIC_DIR
+from app.database import init_db, close_db, keep_pool_warm, warm_pool
 from app.s3 import S3Service
 
-settings = get_settings()
-
 logging.basicConfig(
     level=logging.DEBUG if settings.debug else logging.INFO,
     format="%(asctime)s %(levelname)s %(name)s: %(message)s",
@@ -24,15 +28,32 @@ logger = logging.getLogger("vault")
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     logger.info("Starting Vault v%s", settings.app_version)
+    # Blocking S3/diff work runs in the default executor; size it for a mixed load
+    asyncio.get_running_loop().set_default_executor(
+        ThreadPoolExecutor(max_workers=min(32, (os.cpu_count() or 1) * 4))
+    )
+    files.start_diff_pool()
     await init_db()
     logger.info("Database tables ensured")
+    await warm_pool()
+    await S3Service.start()
     try:
         await S3Service.ensure_bucket()
         logger.info("S3 bucket '%s' ready at %s", settings.s3_bucket, settings.s3_endpoint_url)
     except Exception as e:
         logger.warning("Could not verify S3 bucket: %s", e)
+    pages.precompile_templates()
+    audit_buffer.start()
+    keepalive = asyncio.create_task(keep_pool_warm())
+    dashboard_refresh = asyncio.create_task(pages.refresh_dashboard())
     yield
+    dashboard_refresh.cancel()
+    keepalive.cancel()
+    await audit_buffer.stop()
     await close_db()
+    await S3Service.stop()
+    shutdown_kdf_executor()
+    files.shutdown_diff_pool()
     logger.info("Vault shut down")
 
 
@@ -40,6 +61,7 @@ app = FastAPI(
     title=settings.app_name,
     version=settings.app_version,
     lifespan=lifespan,
+    default_response_class=ORJSONResponse,
 )
 
 # Middleware
@@ -59,6 +81,17 @@ app.include_router(sharing.router)
 app.include_router(pages.router)
 
 
+# Connection pool exhausted: ask the client to back off instead of queueing
+@app.exception_handler(PoolTimeoutError)
+async def pool_timeout_handler(request: Request, exc: PoolTimeoutError):
+    logger.warning("Database pool exhausted: %s", exc)
+    return JSONResponse(
+        status_code=503,
+        content={"detail": "Service busy, please retry"},
+        headers={"Retry-After": "1"},
+    )
+
+
 # Global exception handler
 @app.exception_handler(Exception)
 async def global_exception_handler(request: Request, exc: Exception):
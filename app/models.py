@@ -76,6 +76,10 @@ class FileVersion(Base):
 
     __table_args__ = (
         Index("ix_file_versions_path_version", "file_path", "version", unique=True),
+        # Matches ORDER BY file_path, version DESC for DISTINCT ON latest-version lookups.
+        # A pg_trgm GIN index on file_path for search is created by migration 006 only,
+        # since create_all cannot assume the extension is installed.
+        Index("ix_file_versions_path_version_desc", "file_path", version.desc()),
     )
 
 
@@ -99,6 +103,12 @@ class ChangeRequest(Base):
     reviewer = relationship("User", back_populates="change_requests_reviewed", foreign_keys=[reviewer_id])
     files = relationship("ChangeRequestFile", back_populates="change_request", cascade="all, delete-orphan")
 
+    __table_args__ = (
+        Index("ix_change_requests_status_created", status, created_at.desc()),
+        Index("ix_change_requests_status_updated", status, updated_at.desc()),
+        Index("ix_change_requests_author_updated", author_id, updated_at.desc()),
+    )
+
 
 class ChangeRequestFile(Base):
     __tablename__ = "change_request_files"
@@ -125,7 +135,7 @@ class AuditLog(Base):
 
     id = Column(Integer, primary_key=True, autoincrement=True)
     user_id = Column(Integer, ForeignKey("users.id"), nullable=True)
-    action = Column(String(100), nullable=False, index=True)
+    action = Column(String(100), nullable=False)
     resource_type = Column(String(50), nullable=False)
     resource_id = Column(String(255), default="")
     details = Column(JSON, default=dict)
@@ -135,6 +145,11 @@ class AuditLog(Base):
     # Relationships
     user = relationship("User", back_populates="audit_logs")
 
+    __table_args__ = (
+        Index("ix_audit_logs_action_created", action, created_at.desc()),
+        Index("ix_audit_logs_rtype_created", resource_type, created_at.desc()),
+    )
+
 
 class FileShare(Base):
     __tablename__ = "file_shares"
@@ -144,9 +159,21 @@ class FileShare(Base):
     token = Column(String(64), unique=True, nullable=False, index=True)
     is_public = Column(Boolean, default=False, nullable=False)
     is_archived = Column(Boolean, default=False, nullable=False)
+    # Denormalized state of the path's latest version, kept current by CR merge,
+    # so public links resolve without scanning file_versions
+    latest_version_id = Column(Integer, ForeignKey("file_versions.id"), nullable=True)
+    is_tombstoned = Column(Boolean, default=False, nullable=False)
     created_by_id = Column(Integer, ForeignKey("users.id"), nullable=False)
     created_at = Column(DateTime(timezone=True), default=utcnow, nullable=False)
     updated_at = Column(DateTime(timezone=True), default=utcnow, onupdate=utcnow)
 
     # Relationships
     created_by = relationship("User")
+
+
+class FileCounter(Base):
+    """Denormalized counters maintained by database triggers (see migration 004)."""
+    __tablename__ = "file_counters"
+
+    name = Column(String(50), primary_key=True)
+    value = Column(BigInteger, default=0, nullable=False)
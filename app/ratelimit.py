@@ -0,0 +1,44 @@
+"""In-process sliding-window rate limiting for the auth endpoints.
+
+Each worker keeps its own windows, so the effective limit is multiplied by
+the number of workers. That is enough to stop a single client from pinning
+the password KDF; it is not a substitute for limits at the proxy.
+"""
+
+import math
+import time
+from collections import deque
+from typing import Hashable
+
+from cachetools import TTLCache
+from fastapi import HTTPException, status
+
+
+class SlidingWindowLimiter:
+    """Allow at most `limit` hits per key within any `period`-second window."""
+
+    def __init__(self, limit: int, period: float, max_keys: int = 100_000):
+        self.limit = limit
+        self.period = period
+        # Idle keys expire on their own once their window has fully elapsed
+        self._hits: TTLCache = TTLCache(maxsize=max_keys, ttl=period)
+
+    def hit(self, key: Hashable) -> None:
+        """Record a hit for `key`, raising 429 if the window is already full."""
+        if self.limit <= 0:
+            return
+        now = time.monotonic()
+        window = self._hits.get(key)
+        if window is None:
+            window = deque()
+        while window and window[0] <= now - self.period:
+            window.popleft()
+        if len(window) >= self.limit:
+            retry_after = math.ceil(window[0] + self.period - now)
+            raise HTTPException(
+                status.HTTP_429_TOO_MANY_REQUESTS, "Too many attempts, try again later",
+                headers={"Retry-After": str(max(retry_after, 1))},
+            )
+        window.append(now)
+        # Re-assigning refreshes the entry's TTL
+        self._hits[key] = window
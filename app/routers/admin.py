@@ -1,19 +1,40 @@
 """Admin API routes: user management, audit logs, settings."""
 
+from datetime import datetime
 from typing import Optional
 
+import orjson
+from cachetools import TTLCache
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
-from sqlalchemy import select, func, desc
+from sqlalchemy import select, update, func, desc, tuple_
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import joinedload
 
-from app.auth import get_current_user, require_role, hash_password
-from app.database import get_db
+from app.audit import log_after_commit
+from app.auth import get_current_user, require_role, hash_password, invalidate_user_cache
+from app.database import get_db, get_read_only_db, async_session, ReadOnlySnapshot
 from app.models import User, UserRole, AuditLog
 
 router = APIRouter(prefix="/api/admin", tags=["admin"])
 
+# Base statements built once; per-request filters and limits only add bound
+# parameters, so SQLAlchemy reuses the compiled SQL from its cache.
+_LIST_USERS_STMT = select(User).order_by(User.created_at, User.id)
+_LIST_AUDIT_LOGS_STMT = (
+    select(AuditLog).options(joinedload(AuditLog.user))
+    .order_by(desc(AuditLog.created_at), desc(AuditLog.id))
+)
+
+# Stats change slowly; serve them from memory for up to 30 s
+_stats_cache: TTLCache = TTLCache(maxsize=1, ttl=30)
+
+
+def invalidate_stats_cache():
+    """Drop cached stats, e.g. after a merge changes file/version counts."""
+    _stats_cache.clear()
+
 
 # ── Schemas ──────────────────────────────────────────────────────────────
 
@@ -41,19 +62,39 @@ class AuditLogEntry(BaseModel):
 
 # ── Users ────────────────────────────────────────────────────────────────
 
+def _next_cursor(rows: list, per_page: int) -> Optional[dict]:
+    """Keyset cursor for the page after `rows` (fetched with limit per_page + 1)."""
+    if len(rows) <= per_page:
+        return None
+    last = rows[per_page - 1]
+    return {"after_id": last.id, "after_created_at": last.created_at.isoformat()}
+
+
+def _has_cursor(after_id: Optional[int], after_created_at: Optional[datetime]) -> bool:
+    """True when a keyset cursor was given; both halves are required together."""
+    if (after_id is None) != (after_created_at is None):
+        raise HTTPException(400, "after_id and after_created_at must be given together")
+    return after_id is not None
+
+
 @router.get("/users")
 async def list_users(
-    page: int = Query(1, ge=1),
+    after_id: Optional[int] = None,
+    after_created_at: Optional[datetime] = None,
     per_page: int = Query(50, ge=1, le=100),
+    include_total: bool = False,
     user: User = Depends(require_role(UserRole.admin.value)),
-    db: AsyncSession = Depends(get_db),
+    db: ReadOnlySnapshot = Depends(get_read_only_db),
 ):
-    result = await db.execute(
-        select(User).order_by(User.created_at)
-        .offset((page - 1) * per_page).limit(per_page)
-    )
+    query = _LIST_USERS_STMT
+    if _has_cursor(after_id, after_created_at):
+        query = query.where(tuple_(User.created_at, User.id) > tuple_(after_created_at, after_id))
+    result = await db.execute(query.limit(per_page + 1))
     users = result.scalars().all()
-    total = (await db.execute(select(func.count(User.id)))).scalar()
+
+    total = None
+    if include_total:
+        total = (await db.execute(select(func.count(User.id)))).scalar()
 
     return {
         "items": [
@@ -63,10 +104,10 @@ async def list_users(
                 "is_active": u.is_active,
                 "created_at": u.created_at.isoformat(),
             }
-            for u in users
+            for u in users[:per_page]
         ],
+        "next_cursor": _next_cursor(users, per_page),
         "total": total,
-        "page": page,
         "per_page": per_page,
     }
 
@@ -77,31 +118,30 @@ async def update_user(
     admin: User = Depends(require_role(UserRole.admin.value)),
     db: AsyncSession = Depends(get_db),
 ):
-    result = await db.execute(select(User).where(User.id == user_id))
-    target = result.scalar_one_or_none()
-    if not target:
-        raise HTTPException(404, "User not found")
-
+    values = req.model_dump(exclude_none=True)
     if req.role is not None:
         if req.role not in (UserRole.admin.value, UserRole.approver.value, UserRole.editor.value, UserRole.viewer.value):
             raise HTTPException(400, "Invalid role")
-        if target.id == admin.id and req.role != UserRole.admin.value:
+        if user_id == admin.id and req.role != UserRole.admin.value:
             raise HTTPException(400, "Cannot demote yourself")
-        target.role = req.role
-
     if req.is_active is not None:
-        if target.id == admin.id and not req.is_active:
+        if user_id == admin.id and not req.is_active:
             raise HTTPException(400, "Cannot deactivate yourself")
-        target.is_active = req.is_active
 
-    if req.full_name is not None:
-        target.full_name = req.full_name
-    if req.email is not None:
-        target.email = req.email
+    if values:
+        result = await db.execute(
+            update(User).where(User.id == user_id).values(**values).returning(User.id)
+        )
+        found = result.scalar_one_or_none()
+    else:
+        found = (await db.execute(select(User.id).where(User.id == user_id))).scalar_one_or_none()
+    if found is None:
+        raise HTTPException(404, "User not found")
+    invalidate_user_cache(user_id)
 
-    db.add(AuditLog(
+    log_after_commit(db, AuditLog(
         user_id=admin.id, action="admin.update_user", resource_type="user",
-        resource_id=str(user_id), details=req.model_dump(exclude_none=True),
+        resource_id=str(user_id), details=values,
         ip_address=request.client.host if request.client else "",
     ))
 
@@ -114,17 +154,18 @@ async def reset_user_password(
     admin: User = Depends(require_role(UserRole.admin.value)),
     db: AsyncSession = Depends(get_db),
 ):
-    if len(req.new_password) < 8:
-        raise HTTPException(400, "Password must be at least 8 characters")
+    if len(req.new_password) < 8 or len(req.new_password) > 256:
+        raise HTTPException(400, "Password must be 8-256 characters")
 
     result = await db.execute(select(User).where(User.id == user_id))
     target = result.scalar_one_or_none()
     if not target:
         raise HTTPException(404, "User not found")
 
-    target.password_hash = hash_password(req.new_password)
+    target.password_hash = await hash_password(req.new_password)
+    invalidate_user_cache(user_id)
 
-    db.add(AuditLog(
+    log_after_commit(db, AuditLog(
         user_id=admin.id, action="admin.reset_password", resource_type="user",
         resource_id=str(user_id),
         ip_address=request.client.host if request.client else "",
@@ -139,27 +180,29 @@ async def reset_user_password(
 async def list_audit_logs(
     action: Optional[str] = None,
     resource_type: Optional[str] = None,
-    page: int = Query(1, ge=1),
+    after_id: Optional[int] = None,
+    after_created_at: Optional[datetime] = None,
     per_page: int = Query(50, ge=1, le=100),
+    include_total: bool = False,
     user: User = Depends(require_role(UserRole.admin.value)),
-    db: AsyncSession = Depends(get_db),
+    db: ReadOnlySnapshot = Depends(get_read_only_db),
 ):
-    query = select(AuditLog).options(selectinload(AuditLog.user)).order_by(desc(AuditLog.created_at))
+    filters = []
     if action:
-        query = query.where(AuditLog.action == action)
+        filters.append(AuditLog.action == action)
     if resource_type:
-        query = query.where(AuditLog.resource_type == resource_type)
-    query = query.offset((page - 1) * per_page).limit(per_page)
+        filters.append(AuditLog.resource_type == resource_type)
 
-    result = await db.execute(query)
-    logs = result.scalars().all()
+    query = _LIST_AUDIT_LOGS_STMT.where(*filters)
+    if _has_cursor(after_id, after_created_at):
+        query = query.where(tuple_(AuditLog.created_at, AuditLog.id) < tuple_(after_created_at, after_id))
 
-    count_q = select(func.count(AuditLog.id))
-    if action:
-        count_q = count_q.where(AuditLog.action == action)
-    if resource_type:
-        count_q = count_q.where(AuditLog.resource_type == resource_type)
-    total = (await db.execute(count_q)).scalar()
+    result = await db.execute(query.limit(per_page + 1))
+    logs = result.unique().scalars().all()
+
+    total = None
+    if include_total:
+        total = (await db.execute(select(func.count(AuditLog.id)).where(*filters))).scalar()
 
     return {
         "items": [
@@ -170,39 +213,85 @@ async def list_audit_logs(
                 ip_address=l.ip_address,
                 created_at=l.created_at.isoformat(),
             )
-            for l in logs
+            for l in logs[:per_page]
         ],
+        "next_cursor": _next_cursor(logs, per_page),
         "total": total,
-        "page": page,
         "per_page": per_page,
     }
 
 
+@router.get("/audit-logs/export")
+async def export_audit_logs(
+    action: Optional[str] = None,
+    resource_type: Optional[str] = None,
+    user: User = Depends(require_role(UserRole.admin.value)),
+):
+    """Stream every matching audit log entry as NDJSON."""
+    query = (
+        select(
+            AuditLog.id, User.username, AuditLog.action, AuditLog.resource_type,
+            AuditLog.resource_id, AuditLog.details, AuditLog.ip_address, AuditLog.created_at,
+        )
+        .outerjoin(User, AuditLog.user_id == User.id)
+        .order_by(desc(AuditLog.created_at), desc(AuditLog.id))
+    )
+    if action:
+        query = query.where(AuditLog.action == action)
+    if resource_type:
+        query = query.where(AuditLog.resource_type == resource_type)
+
+    async def rows():
+        # The request-scoped session is closed before the body is streamed,
+        # so the export holds its own session for the server-side cursor.
+        async with async_session() as session:
+            result = await session.stream(query.execution_options(yield_per=1000))
+            async for partition in result.partitions():
+                yield b"".join(
+                    orjson.dumps({
+                        "id": r.id, "user": r.username, "action": r.action,
+                        "resource_type": r.resource_type, "resource_id": r.resource_id,
+                        "details": r.details or {}, "ip_address": r.ip_address,
+                        "created_at": r.created_at.isoformat(),
+                    }) + b"\n"
+                    for r in partition
+                )
+
+    return StreamingResponse(
+        rows(), media_type="application/x-ndjson",
+        headers={"Content-Disposition": 'attachment; filename="audit-logs.ndjson"'},
+    )
+
+
 # ── Stats ────────────────────────────────────────────────────────────────
 
 @router.get("/stats")
 async def get_stats(
     user: User = Depends(require_role(UserRole.admin.value)),
-    db: AsyncSession = Depends(get_db),
+    db: ReadOnlySnapshot = Depends(get_read_only_db),
 ):
-    from app.models import FileVersion, ChangeRequest
-
-    users_total = (await db.execute(select(func.count(User.id)))).scalar()
-    users_active = (await db.execute(select(func.count(User.id)).where(User.is_active == True))).scalar()
-    files_total = (await db.execute(
-        select(func.count(func.distinct(FileVersion.file_path))).where(FileVersion.is_delete == False)
-    )).scalar()
-    versions_total = (await db.execute(select(func.count(FileVersion.id)))).scalar()
-    cr_total = (await db.execute(select(func.count(ChangeRequest.id)))).scalar()
-    cr_pending = (await db.execute(
-        select(func.count(ChangeRequest.id)).where(ChangeRequest.status == "pending_review")
-    )).scalar()
-
-    return {
-        "users_total": users_total,
-        "users_active": users_active,
-        "files_total": files_total,
-        "versions_total": versions_total,
-        "cr_total": cr_total,
-        "cr_pending": cr_pending,
-    }
+    try:
+        return _stats_cache["stats"]
+    except KeyError:
+        pass
+
+    from app.models import FileVersion, ChangeRequest, FileCounter
+
+    # One round-trip: every count is a scalar subquery of a single SELECT
+    stmt = select(
+        select(func.count(User.id)).scalar_subquery().label("users_total"),
+        select(func.count(User.id)).where(User.is_active == True).scalar_subquery().label("users_active"),
+        # Trigger-maintained counter; fall back to counting if it was never seeded
+        func.coalesce(
+            select(FileCounter.value).where(FileCounter.name == "files_total").scalar_subquery(),
+            select(func.count(func.distinct(FileVersion.file_path)))
+            .where(FileVersion.is_delete == False).scalar_subquery(),
+        ).label("files_total"),
+        select(func.count(FileVersion.id)).scalar_subquery().label("versions_total"),
+        select(func.count(ChangeRequest.id)).scalar_subquery().label("cr_total"),
+        select(func.count(ChangeRequest.id))
+        .where(ChangeRequest.status == "pending_review").scalar_subquery().label("cr_pending"),
+    )
+    row = (await db.execute(stmt)).one()
+    stats = _stats_cache["stats"] = row._asdict()
+    return stats
@@ -2,16 +2,23 @@
 
 from fastapi import APIRouter, Depends, HTTPException, Request, Response, status
 from pydantic import BaseModel, EmailStr
-from sqlalchemy import select, func
+from sqlalchemy import select, literal
 from sqlalchemy.ext.asyncio import AsyncSession
 
-from app.auth import hash_password, verify_password, create_access_token, get_current_user
+from app.audit import log_after_commit
+from app.auth import (
+    hash_password, verify_password, password_needs_rehash, create_access_token, get_current_user,
+    get_token_from_request, forget_token, DUMMY_PASSWORD_HASH,
+)
 from app.database import get_db
 from app.models import User, UserRole, AuditLog
-from app.config import get_settings
+from app.config import settings
+from app.ratelimit import SlidingWindowLimiter
 
 router = APIRouter(prefix="/api/auth", tags=["auth"])
-settings = get_settings()
+
+_login_limiter = SlidingWindowLimiter(settings.login_rate_limit, settings.login_rate_period)
+_register_limiter = SlidingWindowLimiter(settings.register_rate_limit, settings.register_rate_period)
 
 
 class RegisterRequest(BaseModel):
@@ -39,32 +46,33 @@ class UserResponse(BaseModel):
 
 @router.post("/register", response_model=UserResponse, status_code=status.HTTP_201_CREATED)
 async def register(req: RegisterRequest, request: Request, db: AsyncSession = Depends(get_db)):
+    _register_limiter.hit(request.client.host if request.client else "")
     if len(req.username) < 3 or len(req.username) > 150:
         raise HTTPException(400, "Username must be 3-150 characters")
-    if len(req.password) < 8:
-        raise HTTPException(400, "Password must be at least 8 characters")
+    if len(req.password) < 8 or len(req.password) > 256:
+        raise HTTPException(400, "Password must be 8-256 characters")
 
     exists = await db.execute(
-        select(User).where((User.username == req.username) | (User.email == req.email))
+        select(User.id).where((User.username == req.username) | (User.email == req.email)).limit(1)
     )
-    if exists.scalar_one_or_none():
+    if exists.scalar() is not None:
         raise HTTPException(409, "Username or email already taken")
 
     # First user gets admin role
-    count = await db.execute(select(func.count(User.id)))
-    total_users = count.scalar()
-    role = UserRole.admin.value if total_users == 0 and settings.auto_admin_first_user else UserRole.viewer.value
+    has_users = (await db.execute(select(literal(1)).select_from(User).limit(1))).scalar() is not None
+    role = UserRole.admin.value if not has_users and settings.auto_admin_first_user else UserRole.viewer.value
 
     user = User(
         username=req.username,
         email=req.email,
-        password_hash=hash_password(req.password),
+        password_hash=await hash_password(req.password),
         full_name=req.full_name,
         role=role,
     )
     db.add(user)
     await db.flush()
 
+    # Written in the request transaction: the row references the new user id
     db.add(AuditLog(
         user_id=user.id, action="user.register", resource_type="user",
         resource_id=str(user.id), ip_address=request.client.host if request.client else "",
@@ -74,13 +82,28 @@ async def register(req: RegisterRequest, request: Request, db: AsyncSession = De
 
 @router.post("/login")
 async def login(req: LoginRequest, request: Request, response: Response, db: AsyncSession = Depends(get_db)):
+    # Keyed by IP and username so one abusive client cannot lock a user out globally
+    _login_limiter.hit((request.client.host if request.client else "", req.username))
+    # Every path that sets a password has required 8+ characters, so shorter
+    # ones can skip the KDF. There is no upper bound here: the 256 cap on
+    # register/reset is newer than some stored passwords.
+    if len(req.password) < 8:
+        raise HTTPException(401, "Invalid credentials")
+
     result = await db.execute(select(User).where(User.username == req.username))
     user = result.scalar_one_or_none()
-    if not user or not verify_password(req.password, user.password_hash):
+    if not user:
+        await verify_password(req.password, DUMMY_PASSWORD_HASH)
+        raise HTTPException(401, "Invalid credentials")
+    if not await verify_password(req.password, user.password_hash):
         raise HTTPException(401, "Invalid credentials")
     if not user.is_active:
         raise HTTPException(403, "Account is deactivated")
 
+    # Upgrade legacy bcrypt / outdated Argon2 hashes while we have the plaintext
+    if password_needs_rehash(user.password_hash):
+        user.password_hash = await hash_password(req.password)
+
     token = create_access_token(user.id, user.username)
     response.set_cookie(
         key="access_token", value=token, httponly=True,
@@ -88,16 +111,24 @@ async def login(req: LoginRequest, request: Request, response: Response, db: Asy
         samesite="lax",
     )
 
-    db.add(AuditLog(
+    log_after_commit(db, AuditLog(
         user_id=user.id, action="user.login", resource_type="user",
         resource_id=str(user.id), ip_address=request.client.host if request.client else "",
     ))
 
-    return {"access_token": token, "token_type": "bearer", "user": UserResponse.model_validate(user)}
+    # Values come straight off the ORM row, so skip Pydantic validation
+    user_out = UserResponse.model_construct(
+        id=user.id, username=user.username, email=user.email,
+        full_name=user.full_name, role=user.role, is_active=user.is_active,
+    )
+    return {"access_token": token, "token_type": "bearer", "user": user_out}
 
 
 @router.post("/logout")
-async def logout(response: Response):
+async def logout(request: Request, response: Response):
+    token = get_token_from_request(request)
+    if token:
+        forget_token(token)
     response.delete_cookie("access_token")
     return {"ok": True}
 
@@ -1,25 +1,70 @@
 """Change Request (approval workflow) API routes."""
 
+import asyncio
 import difflib
+import functools
+from io import BytesIO
 from typing import Optional
 
-from fastapi import APIRouter, Depends, HTTPException, Query, Request
+from cachetools import LRUCache
+from fastapi import APIRouter, Depends, File, Form, HTTPException, Query, Request, UploadFile
 from pydantic import BaseModel
-from sqlalchemy import select, desc, func
+from sqlalchemy import select, insert, desc, func
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import joinedload, raiseload, selectinload
 
+from app.audit import log_after_commit
 from app.auth import get_current_user, require_role
+from app.config import settings
 from app.database import get_db
 from app.models import (
     User, UserRole, ChangeRequest, ChangeRequestFile, CRStatus,
     FileAction, FileVersion, AuditLog,
 )
+from app.routers.admin import invalidate_stats_cache
+from app.routers.sharing import invalidate_share_cache, sync_share_versions
 from app.s3 import S3Service
 
 router = APIRouter(prefix="/api/cr", tags=["change_requests"])
 s3 = S3Service()
 
+# Strong references to fire-and-forget cleanup tasks until they finish
+_background_tasks: set[asyncio.Task] = set()
+
+
+async def _delete_quietly(key: str):
+    try:
+        await s3.delete_object(key)
+    except Exception:
+        pass
+
+
+async def _delete_many_quietly(keys: list[str]):
+    # One DeleteObjects request per 1000 keys instead of a round-trip per key
+    try:
+        await s3.delete_objects(keys)
+    except Exception:
+        pass
+
+
+# Version objects are immutable, so their bytes can be cached by key (64 MiB budget)
+_version_bytes: LRUCache = LRUCache(maxsize=64 * 1024 * 1024, getsizeof=len)
+
+
+async def _get_version_bytes(s3_key: str) -> bytes:
+    data = _version_bytes.get(s3_key)
+    if data is None:
+        data = await s3.get_object(s3_key)
+        if len(data) <= _version_bytes.maxsize:
+            _version_bytes[s3_key] = data
+    return data
+
+
+def _spawn(coro):
+    task = asyncio.create_task(coro)
+    _background_tasks.add(task)
+    task.add_done_callback(_background_tasks.discard)
+
 
 # ── Schemas ──────────────────────────────────────────────────────────────
 
@@ -64,6 +109,12 @@ class CRFileInfo(BaseModel):
     base_version: Optional[int] = None
 
 
+def _unified_diff(old_lines: list[str], new_lines: list[str], fromfile: str, tofile: str) -> str:
+    return "\n".join(difflib.unified_diff(
+        old_lines, new_lines, fromfile=fromfile, tofile=tofile, n=5, lineterm="",
+    ))
+
+
 # ── List CRs ─────────────────────────────────────────────────────────────
 
 @router.get("/list")
@@ -75,40 +126,50 @@ async def list_change_requests(
     user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    query = (
-        select(ChangeRequest)
-        .options(selectinload(ChangeRequest.author), selectinload(ChangeRequest.reviewer),
-                 selectinload(ChangeRequest.files))
-    )
+    filters = []
     if status:
-        query = query.where(ChangeRequest.status == status)
+        filters.append(ChangeRequest.status == status)
     if author_id:
-        query = query.where(ChangeRequest.author_id == author_id)
-    query = query.order_by(desc(ChangeRequest.updated_at))
-    query = query.offset((page - 1) * per_page).limit(per_page)
+        filters.append(ChangeRequest.author_id == author_id)
+
+    # The window count rides along with each page row, so no separate COUNT query
+    file_count_sq = (
+        select(func.count(ChangeRequestFile.id))
+        .where(ChangeRequestFile.change_request_id == ChangeRequest.id)
+        .correlate(ChangeRequest)
+        .scalar_subquery()
+    )
+    query = (
+        select(ChangeRequest, func.count().over().label("total"))
+        .add_columns(file_count_sq.label("file_count"))
+        .options(joinedload(ChangeRequest.author), joinedload(ChangeRequest.reviewer), raiseload("*"))
+        .where(*filters)
+        .order_by(desc(ChangeRequest.updated_at))
+        .offset((page - 1) * per_page).limit(per_page)
+    )
 
     result = await db.execute(query)
-    crs = result.scalars().all()
-
-    # Total count
-    count_q = select(func.count(ChangeRequest.id))
-    if status:
-        count_q = count_q.where(ChangeRequest.status == status)
-    if author_id:
-        count_q = count_q.where(ChangeRequest.author_id == author_id)
-    total = (await db.execute(count_q)).scalar()
+    rows = result.unique().all()
+    if rows:
+        total = rows[0].total
+    elif page > 1:
+        # Past the last page there is no row to carry the count
+        total = (await db.execute(select(func.count(ChangeRequest.id)).where(*filters))).scalar()
+    else:
+        total = 0
 
     return {
+        # Row values are already well-typed, so skip per-item validation
         "items": [
-            CRSummary(
+            CRSummary.model_construct(
                 id=cr.id, title=cr.title, status=cr.status,
                 author=cr.author.username,
                 reviewer=cr.reviewer.username if cr.reviewer else None,
-                file_count=len(cr.files),
+                file_count=file_count,
                 created_at=cr.created_at.isoformat(),
                 updated_at=cr.updated_at.isoformat(),
             )
-            for cr in crs
+            for cr, _, file_count in rows
         ],
         "total": total,
         "page": page,
@@ -127,13 +188,14 @@ async def get_change_request(
     result = await db.execute(
         select(ChangeRequest)
         .options(
-            selectinload(ChangeRequest.author),
-            selectinload(ChangeRequest.reviewer),
+            joinedload(ChangeRequest.author),
+            joinedload(ChangeRequest.reviewer),
             selectinload(ChangeRequest.files).selectinload(ChangeRequestFile.base_version),
+            raiseload("*"),
         )
         .where(ChangeRequest.id == cr_id)
     )
-    cr = result.scalar_one_or_none()
+    cr = result.unique().scalar_one_or_none()
     if not cr:
         raise HTTPException(404, "Change request not found")
 
@@ -183,7 +245,7 @@ async def create_change_request(
     db.add(cr)
     await db.flush()
 
-    db.add(AuditLog(
+    log_after_commit(db, AuditLog(
         user_id=user.id, action="cr.create", resource_type="change_request",
         resource_id=str(cr.id), ip_address=request.client.host if request.client else "",
     ))
@@ -199,7 +261,9 @@ async def update_change_request(
     user: User = Depends(require_role(UserRole.admin.value, UserRole.approver.value, UserRole.editor.value)),
     db: AsyncSession = Depends(get_db),
 ):
-    result = await db.execute(select(ChangeRequest).where(ChangeRequest.id == cr_id))
+    result = await db.execute(
+        select(ChangeRequest).options(raiseload("*")).where(ChangeRequest.id == cr_id)
+    )
     cr = result.scalar_one_or_none()
     if not cr:
         raise HTTPException(404, "Change request not found")
@@ -220,12 +284,26 @@ async def update_change_request(
 
 @router.post("/{cr_id}/files")
 async def add_file_to_cr(
-    cr_id: int, req: AddFileRequest,
+    cr_id: int,
+    request: Request,
+    file_path: Optional[str] = Form(None),
+    action: Optional[str] = Form(None),  # create, edit, delete
+    content: Optional[str] = Form(None),  # text body for create/edit
+    file: Optional[UploadFile] = File(None),  # or a raw upload, streamed to S3
     user: User = Depends(require_role(UserRole.admin.value, UserRole.approver.value, UserRole.editor.value)),
     db: AsyncSession = Depends(get_db),
 ):
+    # JSON bodies (AddFileRequest) are still accepted for existing clients;
+    # the form parser leaves them unread and every field above as None.
+    if request.headers.get("content-type", "").startswith("application/json"):
+        try:
+            req = AddFileRequest.model_validate(await request.json())
+        except ValueError:
+            raise HTTPException(422, "Invalid JSON body")
+        file_path, action, content = req.file_path, req.action, req.content
+
     result = await db.execute(
-        select(ChangeRequest).options(selectinload(ChangeRequest.files))
+        select(ChangeRequest).options(selectinload(ChangeRequest.files), raiseload("*"))
         .where(ChangeRequest.id == cr_id)
     )
     cr = result.scalar_one_or_none()
@@ -236,33 +314,34 @@ async def add_file_to_cr(
     if cr.status not in (CRStatus.draft.value, CRStatus.rejected.value):
         raise HTTPException(400, "Can only modify files in draft or rejected CRs")
 
-    file_path = req.file_path.strip("/")
+    file_path = (file_path or "").strip("/")
     if not file_path:
         raise HTTPException(400, "File path is required")
-    if req.action not in (FileAction.create.value, FileAction.edit.value, FileAction.delete.value):
+    if action not in (FileAction.create.value, FileAction.edit.value, FileAction.delete.value):
         raise HTTPException(400, "Action must be create, edit, or delete")
 
     # Remove existing entry for this path if any
     existing = [f for f in cr.files if f.file_path == file_path]
+    await _delete_many_quietly([e.staging_s3_key for e in existing if e.staging_s3_key])
     for e in existing:
-        if e.staging_s3_key:
-            try:
-                await s3.delete_object(e.staging_s3_key)
-            except Exception:
-                pass
         await db.delete(e)
 
     staging_key = None
     base_version_id = None
 
-    if req.action in (FileAction.create.value, FileAction.edit.value):
-        if req.content is None:
+    if action in (FileAction.create.value, FileAction.edit.value):
+        if file is not None:
+            if file.size is not None and file.size > settings.max_file_size_mb * 1024 * 1024:
+                raise HTTPException(413, f"File exceeds {settings.max_file_size_mb}MB limit")
+            body = file.file
+        elif content is not None:
+            body = BytesIO(content.encode("utf-8"))
+        else:
             raise HTTPException(400, "Content is required for create/edit actions")
-        content_bytes = req.content.encode("utf-8")
         staging_key = S3Service.generate_staging_key()
-        await s3.put_object(staging_key, content_bytes, S3Service.guess_content_type(file_path))
+        await s3.upload_fileobj(staging_key, body, S3Service.guess_content_type(file_path))
 
-    if req.action in (FileAction.edit.value, FileAction.delete.value):
+    if action in (FileAction.edit.value, FileAction.delete.value):
         # Find the base version
         latest_result = await db.execute(
             select(FileVersion)
@@ -273,20 +352,20 @@ async def add_file_to_cr(
         latest = latest_result.scalar_one_or_none()
         if latest and not latest.is_delete:
             base_version_id = latest.id
-        elif req.action == FileAction.edit.value:
+        elif action == FileAction.edit.value:
             raise HTTPException(404, "File does not exist, use 'create' action")
 
     crf = ChangeRequestFile(
         change_request_id=cr_id,
         file_path=file_path,
-        action=req.action,
+        action=action,
         staging_s3_key=staging_key,
         base_version_id=base_version_id,
     )
     db.add(crf)
     await db.flush()
 
-    return {"id": crf.id, "file_path": file_path, "action": req.action}
+    return {"id": crf.id, "file_path": file_path, "action": action}
 
 
 # ── Remove file from CR ─────────────────────────────────────────────────
@@ -297,7 +376,9 @@ async def remove_file_from_cr(
     user: User = Depends(require_role(UserRole.admin.value, UserRole.approver.value, UserRole.editor.value)),
     db: AsyncSession = Depends(get_db),
 ):
-    result = await db.execute(select(ChangeRequest).where(ChangeRequest.id == cr_id))
+    result = await db.execute(
+        select(ChangeRequest).options(raiseload("*")).where(ChangeRequest.id == cr_id)
+    )
     cr = result.scalar_one_or_none()
     if not cr:
         raise HTTPException(404, "Change request not found")
@@ -341,38 +422,38 @@ async def get_cr_file_diff(
     if not crf:
         raise HTTPException(404, "File entry not found")
 
-    old_content = ""
-    new_content = ""
-
-    if crf.base_version and crf.base_version.s3_key:
+    async def _read(key: Optional[str], immutable: bool) -> str:
+        if not key:
+            return ""
         try:
-            old_bytes = await s3.get_object(crf.base_version.s3_key)
-            old_content = old_bytes.decode("utf-8", errors="replace")
+            # Staging objects can be replaced by add_file_to_cr, so only
+            # version objects go through the cache
+            data = await (_get_version_bytes(key) if immutable else s3.get_object(key))
+            return data.decode("utf-8", errors="replace")
         except Exception:
-            old_content = "[Content unavailable]"
+            return "[Content unavailable]"
 
-    if crf.staging_s3_key:
-        try:
-            new_bytes = await s3.get_object(crf.staging_s3_key)
-            new_content = new_bytes.decode("utf-8", errors="replace")
-        except Exception:
-            new_content = "[Content unavailable]"
+    old_content, new_content = await asyncio.gather(
+        _read(crf.base_version.s3_key if crf.base_version else None, immutable=True),
+        _read(crf.staging_s3_key, immutable=False),
+    )
 
     old_lines = old_content.splitlines()
     new_lines = new_content.splitlines()
 
-    diff = difflib.HtmlDiff(tabsize=4, wrapcolumn=120)
-    diff_html = diff.make_table(
+    # The browser renders the unified diff; computing it still runs the
+    # pure-Python matcher, so keep it off the event loop
+    diff_text = await asyncio.get_running_loop().run_in_executor(None, functools.partial(
+        _unified_diff,
         old_lines, new_lines,
-        fromdesc=f"Base (v{crf.base_version.version})" if crf.base_version else "Empty",
-        todesc="Proposed",
-        context=True, numlines=5,
-    )
+        fromfile=f"Base (v{crf.base_version.version})" if crf.base_version else "Empty",
+        tofile="Proposed",
+    ))
 
     return {
         "file_path": crf.file_path,
         "action": crf.action,
-        "diff_html": diff_html,
+        "diff": diff_text,
         "old_content": old_content,
         "new_content": new_content,
     }
@@ -387,7 +468,7 @@ async def submit_for_review(
     db: AsyncSession = Depends(get_db),
 ):
     result = await db.execute(
-        select(ChangeRequest).options(selectinload(ChangeRequest.files))
+        select(ChangeRequest).options(selectinload(ChangeRequest.files), raiseload("*"))
         .where(ChangeRequest.id == cr_id)
     )
     cr = result.scalar_one_or_none()
@@ -405,7 +486,7 @@ async def submit_for_review(
     cr.reviewer_id = None
     cr.reviewed_at = None
 
-    db.add(AuditLog(
+    log_after_commit(db, AuditLog(
         user_id=user.id, action="cr.submit", resource_type="change_request",
         resource_id=str(cr.id), ip_address=request.client.host if request.client else "",
     ))
@@ -423,7 +504,9 @@ async def review_change_request(
 ):
     from datetime import datetime, timezone
 
-    result = await db.execute(select(ChangeRequest).where(ChangeRequest.id == cr_id))
+    result = await db.execute(
+        select(ChangeRequest).options(raiseload("*")).where(ChangeRequest.id == cr_id)
+    )
     cr = result.scalar_one_or_none()
     if not cr:
         raise HTTPException(404, "Change request not found")
@@ -443,7 +526,7 @@ async def review_change_request(
     cr.review_comment = req.comment
     cr.reviewed_at = datetime.now(timezone.utc)
 
-    db.add(AuditLog(
+    log_after_commit(db, AuditLog(
         user_id=user.id, action=f"cr.{req.action}", resource_type="change_request",
         resource_id=str(cr.id), ip_address=request.client.host if request.client else "",
     ))
@@ -463,7 +546,10 @@ async def merge_change_request(
 
     result = await db.execute(
         select(ChangeRequest)
-        .options(selectinload(ChangeRequest.files).selectinload(ChangeRequestFile.base_version))
+        .options(
+            selectinload(ChangeRequest.files).selectinload(ChangeRequestFile.base_version),
+            raiseload("*"),
+        )
         .where(ChangeRequest.id == cr_id)
     )
     cr = result.scalar_one_or_none()
@@ -472,65 +558,76 @@ async def merge_change_request(
     if cr.status != CRStatus.approved.value:
         raise HTTPException(400, "CR must be approved before merging")
 
-    # Apply each file change
-    for crf in cr.files:
-        if crf.action in (FileAction.create.value, FileAction.edit.value):
-            if not crf.staging_s3_key:
-                continue
-            content = await s3.get_object(crf.staging_s3_key)
-            content_type = S3Service.guess_content_type(crf.file_path)
-            content_hash = S3Service.compute_hash(content)
+    # Current max version of every touched path, in one round-trip
+    paths = [crf.file_path for crf in cr.files]
+    ver_rows = await db.execute(
+        select(FileVersion.file_path, func.max(FileVersion.version))
+        .where(FileVersion.file_path.in_(paths))
+        .group_by(FileVersion.file_path)
+    )
+    max_ver = dict(ver_rows.all())
 
-            # Get next version
-            ver_result = await db.execute(
-                select(func.max(FileVersion.version)).where(FileVersion.file_path == crf.file_path)
+    async def _apply(crf: ChangeRequestFile, next_ver: int) -> dict:
+        if crf.action == FileAction.delete.value:
+            await _delete_quietly(crf.file_path)
+            return dict(
+                file_path=crf.file_path, version=next_ver, s3_key="",
+                size=0, content_hash="deleted", author_id=cr.author_id,
+                message=f"CR #{cr.id}: Delete {crf.file_path}", is_delete=True,
             )
-            next_ver = (ver_result.scalar() or 0) + 1
-            version_key = S3Service.generate_version_key()
-
-            await s3.put_object(version_key, content, content_type)
-            await s3.put_object(crf.file_path, content, content_type)
 
-            fv = FileVersion(
-                file_path=crf.file_path, version=next_ver, s3_key=version_key,
-                size=len(content), content_hash=content_hash, author_id=cr.author_id,
-                message=f"CR #{cr.id}: {cr.title}",
-            )
-            db.add(fv)
+        content = await s3.get_object(crf.staging_s3_key)
+        content_type = S3Service.guess_content_type(crf.file_path)
+        content_hash = await asyncio.to_thread(S3Service.compute_hash, content)
+        version_key = S3Service.generate_version_key()
 
-            # Clean up staging
-            try:
-                await s3.delete_object(crf.staging_s3_key)
-            except Exception:
-                pass
+        await asyncio.gather(
+            s3.put_object(version_key, content, content_type),
+            s3.put_object(crf.file_path, content, content_type),
+        )
+        # Staging cleanup is best-effort and need not hold up the response
+        _spawn(_delete_quietly(crf.staging_s3_key))
 
-        elif crf.action == FileAction.delete.value:
-            ver_result = await db.execute(
-                select(func.max(FileVersion.version)).where(FileVersion.file_path == crf.file_path)
-            )
-            next_ver = (ver_result.scalar() or 0) + 1
+        return dict(
+            file_path=crf.file_path, version=next_ver, s3_key=version_key,
+            size=len(content), content_hash=content_hash, author_id=cr.author_id,
+            message=f"CR #{cr.id}: {cr.title}", is_delete=False,
+        )
 
-            fv = FileVersion(
-                file_path=crf.file_path, version=next_ver, s3_key="",
-                size=0, content_hash="deleted", author_id=cr.author_id,
-                message=f"CR #{cr.id}: Delete {crf.file_path}", is_delete=True,
-            )
-            db.add(fv)
-            try:
-                await s3.delete_object(crf.file_path)
-            except Exception:
-                pass
+    # Assign versions up front, then run the S3 work for all files concurrently
+    work = []
+    for crf in cr.files:
+        if crf.action in (FileAction.create.value, FileAction.edit.value):
+            if not crf.staging_s3_key:
+                continue
+        elif crf.action != FileAction.delete.value:
+            continue
+        next_ver = max_ver.get(crf.file_path, 0) + 1
+        max_ver[crf.file_path] = next_ver
+        work.append(_apply(crf, next_ver))
+
+    # One executemany INSERT for all new versions rather than per-object unit of work
+    version_rows = await asyncio.gather(*work)
+    if version_rows:
+        await db.execute(insert(FileVersion), version_rows)
+        await sync_share_versions(db, [row["file_path"] for row in version_rows])
 
     cr.status = CRStatus.merged.value
     cr.merged_at = datetime.now(timezone.utc)
+    invalidate_stats_cache()
 
-    db.add(AuditLog(
+    log_after_commit(db, AuditLog(
         user_id=user.id, action="cr.merge", resource_type="change_request",
         resource_id=str(cr.id),
         details={"file_count": len(cr.files)},
         ip_address=request.client.host if request.client else "",
     ))
 
+    # Cached public links hold the share's pre-merge version state; drop them
+    # only once the new state is committed so it cannot be re-cached stale
+    await db.commit()
+    invalidate_share_cache()
+
     return {"ok": True, "status": cr.status}
 
 
@@ -542,7 +639,9 @@ async def close_change_request(
     user: User = Depends(require_role(UserRole.admin.value, UserRole.approver.value, UserRole.editor.value)),
     db: AsyncSession = Depends(get_db),
 ):
-    result = await db.execute(select(ChangeRequest).where(ChangeRequest.id == cr_id))
+    result = await db.execute(
+        select(ChangeRequest).options(raiseload("*")).where(ChangeRequest.id == cr_id)
+    )
     cr = result.scalar_one_or_none()
     if not cr:
         raise HTTPException(404, "Change request not found")
@@ -555,16 +654,14 @@ async def close_change_request(
 
     # Clean up staging files
     result = await db.execute(
-        select(ChangeRequestFile).where(ChangeRequestFile.change_request_id == cr_id)
+        select(ChangeRequestFile.staging_s3_key).where(
+            ChangeRequestFile.change_request_id == cr_id,
+            ChangeRequestFile.staging_s3_key.is_not(None),
+        )
     )
-    for crf in result.scalars().all():
-        if crf.staging_s3_key:
-            try:
-                await s3.delete_object(crf.staging_s3_key)
-            except Exception:
-                pass
-
-    db.add(AuditLog(
+    await _delete_many_quietly(result.scalars().all())
+
+    log_after_commit(db, AuditLog(
         user_id=user.id, action="cr.close", resource_type="change_request",
         resource_id=str(cr.id), ip_address=request.client.host if request.client else "",
     ))
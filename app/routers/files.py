@@ -4,15 +4,23 @@ All file mutations (save, delete, restore) go through Change Requests.
 Only CR merge writes to the live S3 path. Folder ops remain direct.
 """
 
+import asyncio
 import difflib
-from typing import Optional
-
-from fastapi import APIRouter, Depends, HTTPException, Query, Request, UploadFile, File, Form
+import gzip
+import html
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Optional, Union
+
+import orjson
+from cachetools import LRUCache
+from fastapi import APIRouter, Depends, HTTPException, Query, Request, Response, UploadFile, File, Form
 from pydantic import BaseModel
-from sqlalchemy import select, func, desc, and_
+from sqlalchemy import select, insert, delete, func, desc
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
+from sqlalchemy.orm import aliased, joinedload, raiseload, selectinload
 
+from app.audit import log_after_commit
 from app.auth import get_current_user, require_role
 from app.database import get_db
 from app.models import (
@@ -21,16 +29,23 @@ from app.models import (
     FileShare,
 )
 from app.s3 import S3Service
-from app.config import get_settings
+from app.config import settings
 
 router = APIRouter(prefix="/api/files", tags=["files"])
-settings = get_settings()
 
 s3 = S3Service()
 
 # Roles that can write
 WRITE_ROLES = (UserRole.admin.value, UserRole.approver.value, UserRole.editor.value)
 
+# Rendered version diffs keyed by (old_hash, new_hash, old_ver, new_ver) -> (html, old, new),
+# sized by total characters (64 Mi budget)
+_diff_cache: LRUCache = LRUCache(maxsize=64 * 1024 * 1024, getsizeof=lambda v: sum(map(len, v)))
+
+# HtmlDiff is pure-Python and quadratic, so it runs in worker processes where it
+# neither blocks the event loop nor holds this process's GIL
+_diff_pool: Optional[ProcessPoolExecutor] = None
+
 
 # ── Schemas ──────────────────────────────────────────────────────────────
 
@@ -47,6 +62,11 @@ class FileInfo(BaseModel):
     is_archived: bool = False
 
 
+class BrowseResponse(BaseModel):
+    path: str
+    items: list[FileInfo]
+
+
 class FileDetail(BaseModel):
     path: str
     content: Optional[str] = None
@@ -71,13 +91,19 @@ class VersionInfo(BaseModel):
     created_at: str
 
 
+class SearchResult(BaseModel):
+    path: str
+    size: int
+    version: int
+
+
 class DiffResponse(BaseModel):
     file_path: str
     old_version: int
     new_version: int
     diff_html: str
-    old_content: str
-    new_content: str
+    old_content: Optional[str] = None  # only with include_raw
+    new_content: Optional[str] = None
 
 
 class SaveFileRequest(BaseModel):
@@ -91,7 +117,7 @@ class SaveFileRequest(BaseModel):
 async def _get_latest_version(db: AsyncSession, file_path: str) -> Optional[FileVersion]:
     result = await db.execute(
         select(FileVersion)
-        .options(selectinload(FileVersion.author))
+        .options(joinedload(FileVersion.author), raiseload("*"))
         .where(FileVersion.file_path == file_path)
         .order_by(desc(FileVersion.version))
         .limit(1)
@@ -99,17 +125,129 @@ async def _get_latest_version(db: AsyncSession, file_path: str) -> Optional[File
     return result.scalar_one_or_none()
 
 
-async def _get_next_version(db: AsyncSession, file_path: str) -> int:
-    result = await db.execute(
-        select(func.max(FileVersion.version)).where(FileVersion.file_path == file_path)
+def latest_versions_stmt(*criteria):
+    """SELECT the latest version row per path (PostgreSQL DISTINCT ON).
+
+    Walks ix_file_versions_path_version_desc once instead of aggregating
+    max(version) and joining back.
+    """
+    return (
+        select(FileVersion)
+        .where(*criteria)
+        .order_by(FileVersion.file_path, desc(FileVersion.version))
+        .distinct(FileVersion.file_path)
     )
-    current = result.scalar()
-    return (current or 0) + 1
 
 
-def _generate_diff_html(old_lines: list[str], new_lines: list[str], old_label: str, new_label: str) -> str:
-    diff = difflib.HtmlDiff(tabsize=4, wrapcolumn=120)
-    return diff.make_table(old_lines, new_lines, fromdesc=old_label, todesc=new_label, context=True, numlines=5)
+async def _get_latest_versions_bulk(db: AsyncSession, paths: list[str], *options) -> dict[str, FileVersion]:
+    """Latest version row for each of `paths` in one query, keyed by path."""
+    if not paths:
+        return {}
+    result = await db.execute(latest_versions_stmt(FileVersion.file_path.in_(paths)).options(*options))
+    return {v.file_path: v for v in result.scalars().all()}
+
+
+def _diff_cells(lineno: Optional[int], text: str = "", css: str = "") -> str:
+    if lineno is None:
+        return '<td class="diff_next"></td><td class="diff_header"></td><td></td>'
+    text = html.escape(text.expandtabs(4), quote=False)
+    if css:
+        text = f'<span class="{css}">{text}</span>'
+    return f'<td class="diff_next"></td><td class="diff_header">{lineno}</td><td>{text}</td>'
+
+
+def _generate_diff_html(
+    old_lines: list[str], new_lines: list[str], old_label: str, new_label: str, context: int = 5,
+) -> str:
+    """Side-by-side diff table using difflib.HtmlDiff's layout and CSS classes.
+
+    Each distinct line is mapped to a small int first, so SequenceMatcher
+    compares ints instead of strings, and rows are only emitted for changed
+    hunks plus `context` lines around them.
+    """
+    ids: dict[str, int] = {}
+    a = [ids.setdefault(line, len(ids)) for line in old_lines]
+    b = [ids.setdefault(line, len(ids)) for line in new_lines]
+    matcher = difflib.SequenceMatcher(None, a, b, autojunk=False)
+
+    out = [
+        '<table class="diff" cellspacing="0" cellpadding="0" rules="groups">',
+        '<thead><tr><th class="diff_next"><br /></th>'
+        f'<th colspan="2" class="diff_header">{html.escape(old_label)}</th>'
+        '<th class="diff_next"><br /></th>'
+        f'<th colspan="2" class="diff_header">{html.escape(new_label)}</th></tr></thead>',
+    ]
+    if all(tag == "equal" for tag, *_ in matcher.get_opcodes()):
+        none = '<td class="diff_next"></td><td class="diff_header"></td><td>No Differences Found</td>'
+        out.append(f"<tbody><tr>{none}{none}</tr></tbody>")
+    else:
+        for group in matcher.get_grouped_opcodes(context):
+            out.append("<tbody>")
+            for tag, i1, i2, j1, j2 in group:
+                if tag == "equal":
+                    for k in range(i2 - i1):
+                        out.append(f"<tr>{_diff_cells(i1 + k + 1, old_lines[i1 + k])}"
+                                   f"{_diff_cells(j1 + k + 1, new_lines[j1 + k])}</tr>")
+                    continue
+                # replace/delete/insert: pair removed and added lines side by side
+                for k in range(max(i2 - i1, j2 - j1)):
+                    left = _diff_cells(i1 + k + 1, old_lines[i1 + k], "diff_sub") if i1 + k < i2 else _diff_cells(None)
+                    right = _diff_cells(j1 + k + 1, new_lines[j1 + k], "diff_add") if j1 + k < j2 else _diff_cells(None)
+                    out.append(f"<tr>{left}{right}</tr>")
+            out.append("</tbody>")
+    out.append("</table>")
+    return "".join(out)
+
+
+async def _diff_response(
+    request: Request, path: str, old: int, new: int, diff_html: str,
+    old_content: str, new_content: str, include_raw: bool,
+) -> Response:
+    """Serialize a DiffResponse, gzipped when the client accepts it.
+
+    Compression is applied here rather than app-wide: rendered diffs are
+    large, highly repetitive HTML, while most other responses are small or
+    (file downloads) already compressed.
+    """
+    if not include_raw:
+        old_content = new_content = None
+    body = orjson.dumps(DiffResponse(
+        file_path=path, old_version=old, new_version=new,
+        diff_html=diff_html, old_content=old_content, new_content=new_content,
+    ).model_dump())
+    headers = {"Vary": "Accept-Encoding"}
+    if len(body) >= 1024 and "gzip" in request.headers.get("accept-encoding", ""):
+        body = await asyncio.to_thread(gzip.compress, body, 6)
+        headers["Content-Encoding"] = "gzip"
+    return Response(content=body, media_type="application/json", headers=headers)
+
+
+def start_diff_pool() -> None:
+    """Create the diff worker processes; called from the app lifespan.
+
+    Workers come from a forkserver rather than fork(): by the time a
+    request needs them, this process already runs executor and S3 client
+    threads, and forking a multi-threaded process can deadlock the child.
+    """
+    global _diff_pool
+    if _diff_pool is None:
+        _diff_pool = ProcessPoolExecutor(
+            max_workers=settings.diff_workers,
+            mp_context=multiprocessing.get_context("forkserver"),
+        )
+
+
+def _get_diff_pool() -> ProcessPoolExecutor:
+    if _diff_pool is None:
+        start_diff_pool()
+    return _diff_pool
+
+
+def shutdown_diff_pool() -> None:
+    global _diff_pool
+    if _diff_pool is not None:
+        _diff_pool.shutdown(wait=False, cancel_futures=True)
+        _diff_pool = None
 
 
 async def _get_or_create_draft_cr(db: AsyncSession, user: User, request: Request) -> ChangeRequest:
@@ -145,74 +283,127 @@ async def _get_or_create_draft_cr(db: AsyncSession, user: User, request: Request
     # triggering lazy loads in the async context. The relationship will be
     # empty for a new instance.
 
-    db.add(AuditLog(
+    log_after_commit(db, AuditLog(
         user_id=user.id, action="cr.auto_create", resource_type="change_request",
         resource_id=str(cr.id), ip_address=request.client.host if request.client else "",
     ))
     return cr
 
 
-async def _stage_file_in_cr(
-    db: AsyncSession, cr: ChangeRequest, file_path: str,
-    action: str, content_bytes: Optional[bytes] = None,
-) -> ChangeRequestFile:
-    """Add or replace a file entry in a draft CR."""
-    # Remove existing entry for this path. Query the CR files directly to
-    # avoid triggering a lazy-load / autoflush on `cr.files` in the async
-    # context which causes MissingGreenlet errors.
+async def _count_cr_files(db: AsyncSession, cr_id: int) -> int:
+    # The COUNT autoflushes pending staging rows first, so the total is current
     result = await db.execute(
-        select(ChangeRequestFile).where(
+        select(func.count()).select_from(ChangeRequestFile).where(ChangeRequestFile.change_request_id == cr_id)
+    )
+    return result.scalar_one()
+
+
+async def _stage_files_in_cr_bulk(
+    db: AsyncSession, cr: ChangeRequest, actions: dict[str, str],
+    contents: Optional[dict[str, Union[bytes, BinaryIO]]] = None,
+    latest_map: Optional[dict[str, FileVersion]] = None,
+) -> list[int]:
+    """Add or replace several file entries in a draft CR; returns the new entry ids.
+
+    `actions` maps path -> action and `contents` maps path -> bytes (or a
+    file object, streamed to S3 in parts) for create/edit. Pass
+    `latest_map` when the caller already has the latest versions.
+    Round-trips stay constant regardless of how many paths are staged: one
+    SELECT and one DELETE for the entries being replaced, one DeleteObjects
+    for their staged content, concurrent uploads, and one INSERT for the
+    new entries. Re-staging identical bytes for a path reuses its object.
+    """
+    contents = contents or {}
+
+    # Query the CR files directly rather than through `cr.files` to avoid a
+    # lazy-load in the async context (MissingGreenlet).
+    result = await db.execute(
+        select(ChangeRequestFile.id, ChangeRequestFile.staging_s3_key).where(
             ChangeRequestFile.change_request_id == cr.id,
-            ChangeRequestFile.file_path == file_path,
+            ChangeRequestFile.file_path.in_(list(actions)),
         )
     )
-    existing = result.scalars().all()
-    for e in existing:
-        if e.staging_s3_key:
-            try:
-                await s3.delete_object(e.staging_s3_key)
-            except Exception:
-                pass
-        await db.delete(e)
-
-    staging_key = None
-    base_version_id = None
-
-    # Upload staged content for create/edit
-    if action in (FileAction.create.value, FileAction.edit.value) and content_bytes is not None:
-        staging_key = S3Service.generate_staging_key()
-        await s3.put_object(staging_key, content_bytes, S3Service.guess_content_type(file_path))
-
-    # Find base version for edit/delete
-    if action in (FileAction.edit.value, FileAction.delete.value):
-        latest_result = await db.execute(
-            select(FileVersion)
-            .where(FileVersion.file_path == file_path)
-            .order_by(desc(FileVersion.version))
-            .limit(1)
+    existing = result.all()
+    if existing:
+        await db.execute(
+            delete(ChangeRequestFile).where(ChangeRequestFile.id.in_([crf_id for crf_id, _ in existing]))
+        )
+
+    # In-memory content gets a content-addressed key, so an unchanged re-save
+    # finds its object already staged and skips both the PUT and the delete.
+    existing_keys = {key for _, key in existing if key}
+    staged = {
+        path: content for path, content in contents.items()
+        if actions[path] in (FileAction.create.value, FileAction.edit.value)
+    }
+    # Staging keys embed a digest of each file; a multi-file save hashes them
+    # concurrently in threads instead of one after another on the loop
+    byte_paths = [path for path, content in staged.items() if isinstance(content, bytes)]
+    digest_keys = await asyncio.gather(*(
+        asyncio.to_thread(S3Service.content_staging_key, cr.id, path, staged[path]) for path in byte_paths
+    ))
+    staging_keys = dict(zip(byte_paths, digest_keys))
+    uploads = []
+    for path, content in staged.items():
+        if isinstance(content, bytes):
+            if staging_keys[path] not in existing_keys:
+                uploads.append(s3.put_object(staging_keys[path], content, S3Service.guess_content_type(path)))
+        else:
+            staging_keys[path] = S3Service.generate_staging_key()
+            uploads.append(s3.upload_fileobj(staging_keys[path], content, S3Service.guess_content_type(path)))
+
+    # Drop replaced staged content and upload the new content concurrently
+    s3_work = []
+    stale_keys = list(existing_keys - set(staging_keys.values()))
+    if stale_keys:
+        s3_work.append(s3.delete_objects(stale_keys))
+    s3_work.extend(uploads)
+    outcomes = await asyncio.gather(*s3_work, return_exceptions=True)
+    # Stale-key cleanup is best-effort, but a failed upload must fail the request
+    for i, outcome in enumerate(outcomes):
+        if isinstance(outcome, Exception) and not (stale_keys and i == 0):
+            raise outcome
+
+    # Find base versions for edit/delete
+    if latest_map is None:
+        latest_map = await _get_latest_versions_bulk(
+            db, [p for p, a in actions.items() if a in (FileAction.edit.value, FileAction.delete.value)]
         )
-        latest = latest_result.scalar_one_or_none()
-        if latest and not latest.is_delete:
-            base_version_id = latest.id
-
-    crf = ChangeRequestFile(
-        change_request_id=cr.id,
-        file_path=file_path,
-        action=action,
-        staging_s3_key=staging_key,
-        base_version_id=base_version_id,
-    )
-    db.add(crf)
-    # Do not append to `cr.files` here; mutating the relationship can trigger a
-    # lazy-load/autoflush on `cr` in the async context which leads to
-    # MissingGreenlet errors. The `change_request_id` is already set on `crf`.
-    await db.flush()
-    return crf
+
+    rows = []
+    for path, action in actions.items():
+        base = latest_map.get(path) if action in (FileAction.edit.value, FileAction.delete.value) else None
+        rows.append(dict(
+            change_request_id=cr.id,
+            file_path=path,
+            action=action,
+            staging_s3_key=staging_keys.get(path),
+            base_version_id=base.id if base and not base.is_delete else None,
+        ))
+    # Sent as one multi-row INSERT ... RETURNING (insertmanyvalues), bypassing the unit of work
+    result = await db.execute(insert(ChangeRequestFile).returning(ChangeRequestFile.id), rows)
+    return list(result.scalars())
+
+
+async def _stage_file_in_cr(
+    db: AsyncSession, cr: ChangeRequest, file_path: str,
+    action: str, content: Optional[Union[bytes, BinaryIO]] = None,
+    latest: Optional[FileVersion] = None,
+) -> int:
+    """Add or replace a file entry in a draft CR and return its id.
+
+    Pass `latest` when the caller already looked it up, to skip re-querying
+    the base version.
+    """
+    contents = {file_path: content} if content is not None else None
+    latest_map = {file_path: latest} if latest is not None else None
+    (crf_id,) = await _stage_files_in_cr_bulk(db, cr, {file_path: action}, contents, latest_map)
+    return crf_id
 
 
 # ── Browse ───────────────────────────────────────────────────────────────
 
-@router.get("/browse")
+@router.get("/browse", response_model=BrowseResponse)
 async def browse(
     path: str = Query("", description="Directory path to browse"),
     user: User = Depends(get_current_user),
@@ -228,16 +419,17 @@ async def browse(
     items = []
     file_paths = []
     for folder in sorted(result["folders"]):
-        name = folder.rstrip("/").rsplit("/", 1)[-1] if "/" in folder.rstrip("/") else folder.rstrip("/")
+        folder_path = folder.rstrip("/")
+        name = folder_path.rpartition("/")[2]
         if name.startswith("_"):
             continue
-        items.append(FileInfo(path=folder.rstrip("/"), name=name, is_folder=True))
+        items.append(FileInfo(path=folder_path, name=name, is_folder=True))
 
     for f in sorted(result["files"], key=lambda x: x["key"]):
         key = f["key"]
         if key == prefix or key.startswith("_"):
             continue
-        name = key.rsplit("/", 1)[-1] if "/" in key else key
+        name = key.rpartition("/")[2]
         if not name:
             continue
         file_paths.append(key)
@@ -247,37 +439,36 @@ async def browse(
             last_modified=f["last_modified"].isoformat() if f.get("last_modified") else None,
         ))
 
-    # Enrich file items with share/archive state
+    # Enrich file items with share/archive state and latest version info
+    # (including author) in one round-trip. The FULL JOIN keeps shares for
+    # paths that have no tracked version, and versions that have no share.
     if file_paths:
-        shares_result = await db.execute(
-            select(FileShare).where(FileShare.file_path.in_(file_paths))
-        )
-        share_map = {s.file_path: s for s in shares_result.scalars().all()}
-        for item in items:
-            if not item.is_folder and item.path in share_map:
-                share = share_map[item.path]
-                item.is_public = share.is_public
-                item.is_archived = share.is_archived
-
-        # Fetch latest version info (including author) for each file
-        ver_subq = (
-            select(FileVersion.file_path, func.max(FileVersion.version).label('max_ver'))
-            .where(FileVersion.file_path.in_(file_paths))
-            .group_by(FileVersion.file_path)
-            .subquery()
-        )
-        ver_res = await db.execute(
-            select(FileVersion)
-            .join(ver_subq, and_(FileVersion.file_path == ver_subq.c.file_path, FileVersion.version == ver_subq.c.max_ver))
-            .options(selectinload(FileVersion.author))
+        latest = aliased(FileVersion, latest_versions_stmt(FileVersion.file_path.in_(file_paths)).subquery())
+        share = aliased(FileShare, select(FileShare).where(FileShare.file_path.in_(file_paths)).subquery())
+        rows = await db.execute(
+            select(latest, share)
+            .join(share, share.file_path == latest.file_path, full=True)
+            .options(selectinload(latest.author), raiseload("*"))
         )
-        latest_map = {v.file_path: v for v in ver_res.scalars().all()}
+        share_map = {}
+        latest_map = {}
+        for v, sh in rows.all():
+            if v is not None:
+                latest_map[v.file_path] = v
+            if sh is not None:
+                share_map[sh.file_path] = sh
         for item in items:
-            if not item.is_folder and item.path in latest_map:
+            if item.is_folder:
+                continue
+            if item.path in share_map:
+                sh = share_map[item.path]
+                item.is_public = sh.is_public
+                item.is_archived = sh.is_archived
+            if item.path in latest_map:
                 v = latest_map[item.path]
                 item.version = v.version
                 item.author = v.author.username if v.author else None
-                item.author_id = v.author_id if hasattr(v, 'author_id') else (v.author.id if v.author else None)
+                item.author_id = v.author_id
 
     return {"path": prefix.rstrip("/"), "items": items}
 
@@ -293,7 +484,7 @@ async def get_file_content(
     """Get file content, optionally at a specific version."""
     if version:
         result = await db.execute(
-            select(FileVersion).options(selectinload(FileVersion.author))
+            select(FileVersion).options(joinedload(FileVersion.author), raiseload("*"))
             .where(FileVersion.file_path == path, FileVersion.version == version)
         )
         fv = result.scalar_one_or_none()
@@ -316,13 +507,18 @@ async def get_file_content(
 
     is_binary = not S3Service.is_text_file(path)
     content = None if is_binary else content_bytes.decode("utf-8", errors="replace")
+    if fv:
+        content_hash = fv.content_hash
+    else:
+        # hashlib releases the GIL on large buffers, so this runs truly off-loop
+        content_hash = await asyncio.to_thread(S3Service.compute_hash, content_bytes)
 
     return FileDetail(
         path=path,
         content=content,
         size=len(content_bytes),
         version=fv.version if fv else 0,
-        content_hash=fv.content_hash if fv else S3Service.compute_hash(content_bytes),
+        content_hash=content_hash,
         author=fv.author.username if fv and fv.author else None,
         author_id=fv.author_id if (fv and hasattr(fv, 'author_id')) else (fv.author.id if fv and fv.author else None),
         message=fv.message if fv else "",
@@ -362,24 +558,19 @@ async def save_file(
         cr.title = req.message
 
     # Stage the file
-    await _stage_file_in_cr(db, cr, path, action, content_bytes)
+    await _stage_file_in_cr(db, cr, path, action, content_bytes, latest=latest)
 
-    db.add(AuditLog(
+    log_after_commit(db, AuditLog(
         user_id=user.id, action=f"file.stage_{action}", resource_type="file",
         resource_id=path, details={"cr_id": cr.id},
         ip_address=request.client.host if request.client else "",
     ))
-    await db.flush()
-
-    # Refresh to get the relationship without triggering lazy load
-    await db.refresh(cr, ["files"])
-
     return {
         "cr_id": cr.id,
         "cr_title": cr.title,
         "path": path,
         "action": action,
-        "file_count": len(cr.files),
+        "file_count": await _count_cr_files(db, cr.id),
     }
 
 
@@ -401,9 +592,10 @@ async def upload_file(
     if path.startswith("_"):
         raise HTTPException(400, "Paths starting with _ are reserved")
 
-    content_bytes = await file.read()
+    # The multipart parser has already spooled the upload, so its size is known
+    # up front and the body can be streamed to S3 without reading it into memory.
     max_size = settings.max_file_size_mb * 1024 * 1024
-    if len(content_bytes) > max_size:
+    if file.size is not None and file.size > max_size:
         raise HTTPException(413, f"File exceeds {settings.max_file_size_mb}MB limit")
 
     latest = await _get_latest_version(db, path)
@@ -414,7 +606,7 @@ async def upload_file(
     if message and cr.title.startswith("Changes by "):
         cr.title = message
 
-    await _stage_file_in_cr(db, cr, path, action, content_bytes)
+    await _stage_file_in_cr(db, cr, path, action, file.file, latest=latest)
 
     return {"cr_id": cr.id, "path": path, "action": action}
 
@@ -438,18 +630,14 @@ async def delete_file(
         raise HTTPException(403, "Insufficient permissions to delete this file")
 
     cr = await _get_or_create_draft_cr(db, user, request)
-    await _stage_file_in_cr(db, cr, path, FileAction.delete.value)
+    await _stage_file_in_cr(db, cr, path, FileAction.delete.value, latest=latest)
 
-    db.add(AuditLog(
+    log_after_commit(db, AuditLog(
         user_id=user.id, action="file.stage_delete", resource_type="file",
         resource_id=path, details={"cr_id": cr.id},
         ip_address=request.client.host if request.client else "",
     ))
-    await db.flush()
-
-    # Refresh to get the relationship without triggering lazy load
-    await db.refresh(cr, ["files"])
-    return {"cr_id": cr.id, "path": path, "action": "delete", "file_count": len(cr.files)}
+    return {"cr_id": cr.id, "path": path, "action": "delete", "file_count": await _count_cr_files(db, cr.id)}
 
 
 # ── Create folder (direct, no CR needed) ────────────────────────────────
@@ -482,21 +670,17 @@ async def delete_folder(
     if not path:
         raise HTTPException(400, "Cannot delete root")
 
-    result = await s3.list_objects(prefix=path + "/")
-    keys = [f["key"] for f in result["files"]]
+    keys = [f["key"] for f in await s3.list_objects_tree(path + "/")]
     if not keys:
         raise HTTPException(404, "Folder not found or empty")
 
     cr = await _get_or_create_draft_cr(db, user, request)
-    staged = 0
 
-    for key in keys:
-        if key.startswith("_"):
-            continue
-        latest = await _get_latest_version(db, key)
-        if latest and not latest.is_delete:
-            await _stage_file_in_cr(db, cr, key, FileAction.delete.value)
-            staged += 1
+    latest_map = await _get_latest_versions_bulk(db, [k for k in keys if not k.startswith("_")])
+    actions = {key: FileAction.delete.value for key, latest in latest_map.items() if not latest.is_delete}
+    if actions:
+        await _stage_files_in_cr_bulk(db, cr, actions, latest_map=latest_map)
+    staged = len(actions)
 
     # Delete the folder marker itself (it's just an S3 convention)
     folder_marker = path + "/"
@@ -510,7 +694,7 @@ async def delete_folder(
 
 # ── Version history ──────────────────────────────────────────────────────
 
-@router.get("/history")
+@router.get("/history", response_model=list[VersionInfo])
 async def file_history(
     path: str, user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
@@ -546,7 +730,7 @@ async def restore_version(
 ):
     """Restore a file to a specific version by staging it in the user's draft CR."""
     result = await db.execute(
-        select(FileVersion).where(
+        select(FileVersion).options(raiseload("*")).where(
             FileVersion.file_path == path, FileVersion.version == version
         )
     )
@@ -561,7 +745,7 @@ async def restore_version(
     cr = await _get_or_create_draft_cr(db, user, request)
     await _stage_file_in_cr(db, cr, path, FileAction.edit.value, content)
 
-    db.add(AuditLog(
+    log_after_commit(db, AuditLog(
         user_id=user.id, action="file.stage_restore", resource_type="file",
         resource_id=path, details={"cr_id": cr.id, "from_version": version},
         ip_address=request.client.host if request.client else "",
@@ -572,13 +756,19 @@ async def restore_version(
 
 # ── Diff ─────────────────────────────────────────────────────────────────
 
-@router.get("/diff")
+@router.get("/diff", response_model=DiffResponse)
 async def diff_versions(
+    request: Request,
     path: str, old: int, new: int,
+    include_raw: bool = False,
     user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
-    """Compare two versions of a file."""
+    """Compare two versions of a file.
+
+    The raw contents of both sides are only returned with `include_raw`;
+    `diff_html` already carries every line the client renders.
+    """
     result_old = await db.execute(
         select(FileVersion).where(FileVersion.file_path == path, FileVersion.version == old)
     )
@@ -590,55 +780,66 @@ async def diff_versions(
     if not ver_old or not ver_new:
         raise HTTPException(404, "One or both versions not found")
 
-    old_content = ""
-    if not ver_old.is_delete:
-        try:
-            old_bytes = await s3.get_object(ver_old.s3_key)
-            old_content = old_bytes.decode("utf-8", errors="replace")
-        except Exception:
-            old_content = "[Content unavailable]"
+    # Binary or oversized content is never fetched or diffed
+    if not S3Service.is_text_file(path) or max(ver_old.size or 0, ver_new.size or 0) > settings.max_diff_size_bytes:
+        return await _diff_response(
+            request, path, old, new, "<p>Binary or oversized file; diff not available.</p>", "", "", include_raw,
+        )
 
-    new_content = ""
-    if not ver_new.is_delete:
-        try:
-            new_bytes = await s3.get_object(ver_new.s3_key)
-            new_content = new_bytes.decode("utf-8", errors="replace")
-        except Exception:
-            new_content = "[Content unavailable]"
+    # Versions are immutable, so the rendered diff can be reused by content hash
+    cache_key = (ver_old.content_hash, ver_new.content_hash, old, new)
+    cached = _diff_cache.get(cache_key)
+    if cached is not None:
+        diff_html, old_content, new_content = cached
+        return await _diff_response(request, path, old, new, diff_html, old_content, new_content, include_raw)
+
+    # Fetch both sides concurrently; deletion records have no content
+    live = [v for v in (ver_old, ver_new) if not v.is_delete]
+    fetched = dict(zip(
+        [v.id for v in live],
+        await s3.get_objects_batch([v.s3_key for v in live], return_exceptions=True),
+    ))
+
+    def _content(ver: FileVersion) -> str:
+        if ver.is_delete:
+            return ""
+        data = fetched[ver.id]
+        if isinstance(data, Exception):
+            return "[Content unavailable]"
+        return data.decode("utf-8", errors="replace")
+
+    old_content = _content(ver_old)
+    new_content = _content(ver_new)
 
     old_lines = old_content.splitlines()
     new_lines = new_content.splitlines()
-    diff_html = _generate_diff_html(old_lines, new_lines, f"v{old}", f"v{new}")
-
-    return DiffResponse(
-        file_path=path, old_version=old, new_version=new,
-        diff_html=diff_html, old_content=old_content, new_content=new_content,
+    diff_html = await asyncio.get_running_loop().run_in_executor(
+        _get_diff_pool(), _generate_diff_html, old_lines, new_lines, f"v{old}", f"v{new}",
     )
+    # Don't pin a placeholder for content that failed to load
+    if not any(isinstance(data, Exception) for data in fetched.values()):
+        _diff_cache[cache_key] = (diff_html, old_content, new_content)
+
+    return await _diff_response(request, path, old, new, diff_html, old_content, new_content, include_raw)
 
 
 # ── Search ───────────────────────────────────────────────────────────────
 
-@router.get("/search")
+@router.get("/search", response_model=list[SearchResult])
 async def search_files(
     q: str = Query(..., min_length=1),
     user: User = Depends(get_current_user),
     db: AsyncSession = Depends(get_db),
 ):
     """Search files by path name."""
-    subq = (
-        select(FileVersion.file_path, func.max(FileVersion.version).label("max_ver"))
-        .group_by(FileVersion.file_path)
-        .subquery()
-    )
+    # The path filter goes inside DISTINCT ON (it is constant per path and can
+    # use the trigram index); is_delete must be checked on the latest row only.
+    latest = aliased(FileVersion, latest_versions_stmt(FileVersion.file_path.ilike(f"%{q}%")).subquery())
     result = await db.execute(
-        select(FileVersion)
-        .join(subq, and_(
-            FileVersion.file_path == subq.c.file_path,
-            FileVersion.version == subq.c.max_ver,
-        ))
-        .where(FileVersion.is_delete == False, FileVersion.file_path.ilike(f"%{q}%"))
-        .order_by(FileVersion.file_path)
+        select(latest)
+        .where(latest.is_delete == False)
+        .order_by(latest.file_path)
         .limit(50)
     )
     versions = result.scalars().all()
-    return [{"path": v.file_path, "size": v.size, "version": v.version} for v in versions]
+    return [SearchResult(path=v.file_path, size=v.size, version=v.version) for v in versions]
@@ -1,24 +1,55 @@
 """Server-side rendered page routes."""
 
+import asyncio
+import logging
+import time
+from typing import Optional, Union
+
+from cachetools import TTLCache
 from fastapi import APIRouter, Depends, Request, HTTPException
-from fastapi.responses import HTMLResponse, RedirectResponse, Response
+from fastapi.responses import HTMLResponse, RedirectResponse, StreamingResponse
 from fastapi.templating import Jinja2Templates
-from sqlalchemy import select, desc, func, and_
+from jinja2 import FileSystemBytecodeCache
+from sqlalchemy import select, desc, func
 from sqlalchemy.ext.asyncio import AsyncSession
-from sqlalchemy.orm import selectinload
-
-from app.auth import get_optional_user, get_current_user
-from app.config import TEMPLATES_DIR
-from app.database import get_db
-from app.models import User, FileVersion, ChangeRequest, AuditLog, CRStatus, FileShare
+from sqlalchemy.orm import aliased, raiseload, selectinload
+
+from app.auth import get_optional_user, get_current_user, constant_time_eq
+from app.config import settings, TEMPLATES_DIR, JINJA_CACHE_DIR
+from app.database import get_db, async_session
+from app.models import User, FileVersion, ChangeRequest, AuditLog, CRStatus, FileCounter
+from app.routers.files import latest_versions_stmt
+from app.routers.sharing import get_public_share
 from app.s3 import S3Service
 
+logger = logging.getLogger("vault.pages")
+
 router = APIRouter(tags=["pages"])
 templates = Jinja2Templates(directory=str(TEMPLATES_DIR))
+# Templates only change on deploy; skip the mtime check on every render
+templates.env.auto_reload = settings.debug
+
 
+def precompile_templates() -> None:
+    """Compile every template at startup so no request pays for it.
 
-def _redirect_login():
-    return RedirectResponse(url="/login", status_code=302)
+    Bytecode is also written to JINJA_CACHE_DIR, so the other workers and
+    later restarts load it instead of compiling again.
+    """
+    try:
+        JINJA_CACHE_DIR.mkdir(exist_ok=True)
+        templates.env.bytecode_cache = FileSystemBytecodeCache(str(JINJA_CACHE_DIR))
+    except OSError:
+        pass  # read-only filesystem: compile in memory only
+    for name in templates.env.list_templates(extensions=["html"]):
+        templates.env.get_template(name)
+
+
+async def get_user_or_redirect(user: Optional[User] = Depends(get_optional_user)) -> User:
+    """Page dependency: the signed-in user, or a redirect to the login page."""
+    if not user:
+        raise HTTPException(status_code=302, headers={"Location": "/login"})
+    return user
 
 
 # ── Auth pages ───────────────────────────────────────────────────────────
@@ -39,53 +70,121 @@ async def register_page(request: Request, user: User = Depends(get_optional_user
 
 # ── Dashboard ────────────────────────────────────────────────────────────
 
-@router.get("/", response_class=HTMLResponse)
-async def dashboard(request: Request, user: User = Depends(get_optional_user), db: AsyncSession = Depends(get_db)):
-    if not user:
-        return _redirect_login()
+# Nothing on the dashboard depends on who is looking, so one entry serves everyone
+_dashboard_cache: TTLCache = TTLCache(maxsize=1, ttl=5)
+_dashboard_lock = asyncio.Lock()
+# When the page was last requested; the background refresh idles without viewers
+_dashboard_last_seen = float("-inf")
+
+
+async def _fetch_all(stmt) -> list:
+    # One short-lived session per query: a single AsyncSession cannot run
+    # statements concurrently, separate pooled connections can. Rows outlive
+    # their session, so the queries raiseload anything they do not eager-load.
+    async with async_session() as session:
+        return (await session.execute(stmt)).scalars().all()
+
+
+async def _fetch_one(stmt):
+    async with async_session() as session:
+        return (await session.execute(stmt)).one()
+
 
+async def _load_dashboard() -> dict:
+    """Run the dashboard queries and return the template context they fill."""
     # Recent activity
-    recent_logs = await db.execute(
-        select(AuditLog).options(selectinload(AuditLog.user))
+    recent_logs = (
+        select(AuditLog).options(selectinload(AuditLog.user), raiseload("*"))
         .order_by(desc(AuditLog.created_at)).limit(20)
     )
-    logs = recent_logs.scalars().all()
 
     # Pending CRs
-    pending_crs = await db.execute(
-        select(ChangeRequest).options(selectinload(ChangeRequest.author))
+    pending_crs = (
+        select(ChangeRequest).options(selectinload(ChangeRequest.author), raiseload("*"))
         .where(ChangeRequest.status == CRStatus.pending_review.value)
         .order_by(desc(ChangeRequest.created_at)).limit(10)
     )
-    pending = pending_crs.scalars().all()
 
-    # Recent files
-    subq = (
-        select(FileVersion.file_path, func.max(FileVersion.version).label("max_ver"))
-        .group_by(FileVersion.file_path).subquery()
+    # Recent files: latest version per path via DISTINCT ON, skipping deleted paths
+    latest = aliased(FileVersion, latest_versions_stmt().subquery())
+    recent_files = (
+        select(latest).options(selectinload(latest.author), raiseload("*"))
+        .where(latest.is_delete == False)
+        .order_by(desc(latest.created_at)).limit(10)
     )
-    recent_files = await db.execute(
-        select(FileVersion).options(selectinload(FileVersion.author))
-        .join(subq, and_(
-            FileVersion.file_path == subq.c.file_path,
-            FileVersion.version == subq.c.max_ver,
-        ))
-        .where(FileVersion.is_delete == False)
-        .order_by(desc(FileVersion.created_at)).limit(10)
+
+    # Totals in one round-trip, same shape as the admin stats query
+    totals = select(
+        # Trigger-maintained counter; fall back to counting if it was never seeded
+        func.coalesce(
+            select(FileCounter.value).where(FileCounter.name == "files_total").scalar_subquery(),
+            select(func.count(func.distinct(FileVersion.file_path)))
+            .where(FileVersion.is_delete == False).scalar_subquery(),
+        ).label("files"),
+        select(func.count(FileVersion.id)).scalar_subquery().label("versions"),
+        select(func.count(ChangeRequest.id)).scalar_subquery().label("crs"),
     )
-    files = recent_files.scalars().all()
 
-    # Stats
-    total_files = (await db.execute(
-        select(func.count(func.distinct(FileVersion.file_path))).where(FileVersion.is_delete == False)
-    )).scalar() or 0
-    total_versions = (await db.execute(select(func.count(FileVersion.id)))).scalar() or 0
-    total_crs = (await db.execute(select(func.count(ChangeRequest.id)))).scalar() or 0
+    # The queries are independent, so their round-trips overlap
+    logs, pending, files, counts = await asyncio.gather(
+        _fetch_all(recent_logs),
+        _fetch_all(pending_crs),
+        _fetch_all(recent_files),
+        _fetch_one(totals),
+    )
 
-    return templates.TemplateResponse("dashboard.html", {
-        "request": request, "user": user,
+    return {
         "logs": logs, "pending_crs": pending, "recent_files": files,
-        "total_files": total_files, "total_versions": total_versions, "total_crs": total_crs,
+        "total_files": counts.files or 0, "total_versions": counts.versions or 0, "total_crs": counts.crs or 0,
+    }
+
+
+async def _dashboard_data() -> dict:
+    """Dashboard context, shared by every user for a few seconds."""
+    try:
+        return _dashboard_cache["data"]
+    except KeyError:
+        pass
+    # One request refills an expired entry; the rest wait and reuse it
+    async with _dashboard_lock:
+        try:
+            return _dashboard_cache["data"]
+        except KeyError:
+            pass
+        data = _dashboard_cache["data"] = await _load_dashboard()
+        return data
+
+
+async def refresh_dashboard(interval: float = 4.0, idle_after: float = 60.0):
+    """Keep the dashboard snapshot fresh while someone is viewing it.
+
+    Runs per worker from the app lifespan. The interval stays below the
+    cache TTL, so active viewers never wait on the queries; once nobody
+    has loaded the page for `idle_after` seconds the task stops querying
+    and requests fall back to loading the snapshot themselves.
+    """
+    failing = False
+    while True:
+        await asyncio.sleep(interval)
+        if time.monotonic() - _dashboard_last_seen > idle_after:
+            continue
+        try:
+            _dashboard_cache["data"] = await _load_dashboard()
+        except Exception as e:
+            # Warn once per outage rather than on every tick
+            if not failing:
+                logger.warning("Dashboard refresh failed: %s", e)
+            failing = True
+        else:
+            failing = False
+
+
+@router.get("/", response_class=HTMLResponse)
+async def dashboard(request: Request, user: User = Depends(get_user_or_redirect)):
+    global _dashboard_last_seen
+    _dashboard_last_seen = time.monotonic()
+    return templates.TemplateResponse("dashboard.html", {
+        "request": request, "user": user, **(await _dashboard_data()),
     })
 
 
@@ -93,9 +192,7 @@ async def dashboard(request: Request, user: User = Depends(get_optional_user), d
 
 @router.get("/browse", response_class=HTMLResponse)
 @router.get("/browse/{path:path}", response_class=HTMLResponse)
-async def browser_page(request: Request, path: str = "", user: User = Depends(get_optional_user)):
-    if not user:
-        return _redirect_login()
+async def browser_page(request: Request, path: str = "", user: User = Depends(get_user_or_redirect)):
     return templates.TemplateResponse("browser.html", {
         "request": request, "user": user, "current_path": path,
     })
@@ -104,18 +201,14 @@ async def browser_page(request: Request, path: str = "", user: User = Depends(ge
 # ── File editor ──────────────────────────────────────────────────────────
 
 @router.get("/edit", response_class=HTMLResponse)
-async def editor_page(request: Request, path: str = "", user: User = Depends(get_optional_user)):
-    if not user:
-        return _redirect_login()
+async def editor_page(request: Request, path: str = "", user: User = Depends(get_user_or_redirect)):
     return templates.TemplateResponse("editor.html", {
         "request": request, "user": user, "file_path": path, "mode": "edit",
     })
 
 
 @router.get("/new", response_class=HTMLResponse)
-async def new_file_page(request: Request, path: str = "", user: User = Depends(get_optional_user)):
-    if not user:
-        return _redirect_login()
+async def new_file_page(request: Request, path: str = "", user: User = Depends(get_user_or_redirect)):
     return templates.TemplateResponse("editor.html", {
         "request": request, "user": user, "file_path": path, "mode": "new",
     })
@@ -126,10 +219,8 @@ async def new_file_page(request: Request, path: str = "", user: User = Depends(g
 @router.get("/diff", response_class=HTMLResponse)
 async def diff_page(
     request: Request, path: str = "", old: int = 0, new: int = 0,
-    user: User = Depends(get_optional_user),
+    user: User = Depends(get_user_or_redirect),
 ):
-    if not user:
-        return _redirect_login()
     return templates.TemplateResponse("diff.html", {
         "request": request, "user": user,
         "file_path": path, "old_version": old, "new_version": new,
@@ -139,9 +230,7 @@ async def diff_page(
 # ── Version history ──────────────────────────────────────────────────────
 
 @router.get("/history", response_class=HTMLResponse)
-async def history_page(request: Request, path: str = "", user: User = Depends(get_optional_user)):
-    if not user:
-        return _redirect_login()
+async def history_page(request: Request, path: str = "", user: User = Depends(get_user_or_redirect)):
     return templates.TemplateResponse("history.html", {
         "request": request, "user": user, "file_path": path,
     })
@@ -150,27 +239,21 @@ async def history_page(request: Request, path: str = "", user: User = Depends(ge
 # ── Change requests ──────────────────────────────────────────────────────
 
 @router.get("/change-requests", response_class=HTMLResponse)
-async def change_requests_page(request: Request, user: User = Depends(get_optional_user)):
-    if not user:
-        return _redirect_login()
+async def change_requests_page(request: Request, user: User = Depends(get_user_or_redirect)):
     return templates.TemplateResponse("change_requests.html", {
         "request": request, "user": user,
     })
 
 
 @router.get("/change-requests/new", response_class=HTMLResponse)
-async def new_cr_page(request: Request, user: User = Depends(get_optional_user)):
-    if not user:
-        return _redirect_login()
+async def new_cr_page(request: Request, user: User = Depends(get_user_or_redirect)):
     return templates.TemplateResponse("cr_new.html", {
         "request": request, "user": user,
     })
 
 
 @router.get("/change-requests/{cr_id}", response_class=HTMLResponse)
-async def cr_detail_page(request: Request, cr_id: int, user: User = Depends(get_optional_user)):
-    if not user:
-        return _redirect_login()
+async def cr_detail_page(request: Request, cr_id: int, user: User = Depends(get_user_or_redirect)):
     return templates.TemplateResponse("cr_detail.html", {
         "request": request, "user": user, "cr_id": cr_id,
     })
@@ -179,9 +262,7 @@ async def cr_detail_page(request: Request, cr_id: int, user: User = Depends(get_
 # ── Admin pages ──────────────────────────────────────────────────────────
 
 @router.get("/admin/users", response_class=HTMLResponse)
-async def admin_users_page(request: Request, user: User = Depends(get_optional_user)):
-    if not user:
-        return _redirect_login()
+async def admin_users_page(request: Request, user: User = Depends(get_user_or_redirect)):
     if user.role != "admin":
         raise HTTPException(403, "Admin access required")
     return templates.TemplateResponse("admin_users.html", {
@@ -190,9 +271,7 @@ async def admin_users_page(request: Request, user: User = Depends(get_optional_u
 
 
 @router.get("/admin/audit-log", response_class=HTMLResponse)
-async def admin_audit_page(request: Request, user: User = Depends(get_optional_user)):
-    if not user:
-        return _redirect_login()
+async def admin_audit_page(request: Request, user: User = Depends(get_user_or_redirect)):
     if user.role != "admin":
         raise HTTPException(403, "Admin access required")
     return templates.TemplateResponse("admin_audit.html", {
@@ -204,14 +283,36 @@ async def admin_audit_page(request: Request, user: User = Depends(get_optional_u
 
 s3 = S3Service()
 
+
+async def _stream_download(file_path: str) -> Union[StreamingResponse, RedirectResponse]:
+    """Send an object to the client as an attachment without buffering it.
+
+    With presigned downloads enabled the client is redirected to S3 and
+    the bytes never pass through the app.
+    """
+    filename = file_path.rpartition("/")[2]
+    if settings.s3_presign_downloads:
+        url = await s3.presign_get(file_path, settings.s3_presign_expires, filename=filename)
+        return RedirectResponse(url=url, status_code=302)
+    try:
+        size, chunks = await s3.open_object(file_path)
+    except Exception:
+        raise HTTPException(404, "File content not found")
+    return StreamingResponse(
+        chunks,
+        media_type=S3Service.guess_content_type(file_path),
+        headers={
+            "Content-Disposition": f'attachment; filename="{filename}"',
+            "Content-Length": str(size),
+        },
+    )
+
+
 @router.get("/public/{token}", response_class=HTMLResponse)
 async def public_file(request: Request, token: str, db: AsyncSession = Depends(get_db)):
     """Serve a publicly shared file — no authentication required."""
-    result = await db.execute(
-        select(FileShare).where(FileShare.token == token)
-    )
-    share = result.scalar_one_or_none()
-    if not share or not share.is_public:
+    share = await get_public_share(db, ("token", token))
+    if not share or not constant_time_eq(share.token, token) or not share.is_public:
         raise HTTPException(404, "File not found or not public")
 
     if share.is_archived:
@@ -221,24 +322,16 @@ async def public_file(request: Request, token: str, db: AsyncSession = Depends(g
             "file_path": share.file_path,
         })
 
-    # Get latest non-deleted version
-    ver_result = await db.execute(
-        select(FileVersion)
-        .where(FileVersion.file_path == share.file_path)
-        .order_by(desc(FileVersion.version))
-        .limit(1)
-    )
-    fv = ver_result.scalar_one_or_none()
-    if not fv or fv.is_delete:
+    # No versions at all, or the latest one is a delete
+    if share.latest_version_id is None or share.is_tombstoned:
         raise HTTPException(404, "File not found or deleted")
 
-    try:
-        content_bytes = await s3.get_object(share.file_path)
-    except Exception:
-        raise HTTPException(404, "File content not found")
-
     is_text = S3Service.is_text_file(share.file_path)
     if is_text:
+        try:
+            content_bytes = await s3.get_object(share.file_path)
+        except Exception:
+            raise HTTPException(404, "File content not found")
         content = content_bytes.decode("utf-8", errors="replace")
         return templates.TemplateResponse("public_file.html", {
             "request": request,
@@ -248,59 +341,29 @@ async def public_file(request: Request, token: str, db: AsyncSession = Depends(g
             "error": None,
         })
     else:
-        content_type = S3Service.guess_content_type(share.file_path)
-        filename = share.file_path.rsplit("/", 1)[-1] if "/" in share.file_path else share.file_path
-        return Response(
-            content=content_bytes,
-            media_type=content_type,
-            headers={"Content-Disposition": f'attachment; filename="{filename}"'},
-        )
+        return await _stream_download(share.file_path)
 
 
 @router.get("/public/raw/{path:path}")
 async def public_file_raw(path: str, db: AsyncSession = Depends(get_db)):
     """Return the raw file bytes for a public share (no preview/template). Path is the file path (e.g. test/test.json)."""
-    result = await db.execute(
-        select(FileShare).where(FileShare.file_path == path)
-    )
-    share = result.scalar_one_or_none()
+    share = await get_public_share(db, ("path", path))
     if not share or not share.is_public:
         raise HTTPException(404, "File not found or not public")
 
     if share.is_archived:
         raise HTTPException(410, "File has been archived")
 
-    # Get latest non-deleted version
-    ver_result = await db.execute(
-        select(FileVersion)
-        .where(FileVersion.file_path == share.file_path)
-        .order_by(desc(FileVersion.version))
-        .limit(1)
-    )
-    fv = ver_result.scalar_one_or_none()
-    if not fv or fv.is_delete:
+    if share.latest_version_id is None or share.is_tombstoned:
         raise HTTPException(404, "File not found or deleted")
 
-    try:
-        content_bytes = await s3.get_object(share.file_path)
-    except Exception:
-        raise HTTPException(404, "File content not found")
-
-    content_type = S3Service.guess_content_type(share.file_path)
-    filename = share.file_path.rsplit("/", 1)[-1] if "/" in share.file_path else share.file_path
-    return Response(
-        content=content_bytes,
-        media_type=content_type,
-        headers={"Content-Disposition": f'attachment; filename="{filename}"'},
-    )
+    return await _stream_download(share.file_path)
 
 
 # ── Settings ─────────────────────────────────────────────────────────────
 
 @router.get("/settings", response_class=HTMLResponse)
-async def settings_page(request: Request, user: User = Depends(get_optional_user)):
-    if not user:
-        return _redirect_login()
+async def settings_page(request: Request, user: User = Depends(get_user_or_redirect)):
     return templates.TemplateResponse("settings.html", {
         "request": request, "user": user,
     })
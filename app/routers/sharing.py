@@ -1,23 +1,99 @@
 """File sharing, public links, and archive API routes."""
 
 import uuid
+from typing import NamedTuple, Optional
 from urllib.parse import quote
 
+from cachetools import TTLCache
 from fastapi import APIRouter, Depends, HTTPException, Query, Request
-from sqlalchemy import select
+from sqlalchemy import select, update, desc, func
 from sqlalchemy.ext.asyncio import AsyncSession
 
+from app.audit import log_after_commit
 from app.auth import get_current_user, require_role
 from app.database import get_db
-from app.models import User, FileShare, AuditLog, UserRole
+from app.models import User, FileShare, FileVersion, AuditLog, UserRole
 from app.s3 import S3Service
-from app.config import get_settings
+from app.config import settings
 
 router = APIRouter(prefix="/api/files", tags=["sharing"])
-settings = get_settings()
 
 WRITE_ROLES = (UserRole.admin.value, UserRole.approver.value, UserRole.editor.value)
 
+# Public-link state for the /public routes, keyed by ("token", t) and ("path", p).
+# Per process: other workers see a toggle once their entry expires.
+_share_cache: TTLCache = TTLCache(maxsize=4096, ttl=30)
+
+
+def invalidate_share_cache(share: Optional[FileShare] = None):
+    """Drop cached public-link state for one share, or for all of them."""
+    if share is None:
+        _share_cache.clear()
+        return
+    _share_cache.pop(("token", share.token), None)
+    _share_cache.pop(("path", share.file_path), None)
+
+
+class PublicShare(NamedTuple):
+    token: str
+    file_path: str
+    is_public: bool
+    is_archived: bool
+    latest_version_id: Optional[int]
+    is_tombstoned: bool
+
+
+async def get_public_share(db: AsyncSession, key: tuple[str, str]) -> Optional[PublicShare]:
+    """Share state for a public link, by ("token", token) or ("path", file_path).
+
+    The share row carries its path's latest-version state, so this is a
+    single indexed lookup; hits are cached for a few seconds since public
+    links are fetched repeatedly.
+    """
+    try:
+        return _share_cache[key]
+    except KeyError:
+        pass
+    kind, value = key
+    column = FileShare.token if kind == "token" else FileShare.file_path
+    result = await db.execute(
+        select(
+            FileShare.token, FileShare.file_path, FileShare.is_public, FileShare.is_archived,
+            FileShare.latest_version_id, FileShare.is_tombstoned,
+        ).where(column == value)
+    )
+    row = result.one_or_none()
+    if row is None:
+        return None
+    share = _share_cache[key] = PublicShare(*row)
+    return share
+
+
+def _latest_version_col(column):
+    """Correlated subquery: `column` of the latest version of the share's path."""
+    return (
+        select(column)
+        .where(FileVersion.file_path == FileShare.file_path)
+        .order_by(desc(FileVersion.version))
+        .limit(1)
+        .scalar_subquery()
+    )
+
+
+async def sync_share_versions(db: AsyncSession, paths: list[str]):
+    """Refresh the denormalized latest-version state of any shares on `paths`."""
+    if not paths:
+        return
+    await db.execute(
+        update(FileShare)
+        .where(FileShare.file_path.in_(paths))
+        .values(
+            latest_version_id=_latest_version_col(FileVersion.id),
+            is_tombstoned=func.coalesce(_latest_version_col(FileVersion.is_delete), False),
+        )
+        .execution_options(synchronize_session=False)
+    )
+
 
 async def _get_or_create_share(db: AsyncSession, file_path: str, user: User) -> FileShare:
     """Find or create a FileShare record for the given path."""
@@ -28,11 +104,20 @@ async def _get_or_create_share(db: AsyncSession, file_path: str, user: User) ->
     if share:
         return share
 
+    result = await db.execute(
+        select(FileVersion.id, FileVersion.is_delete)
+        .where(FileVersion.file_path == file_path)
+        .order_by(desc(FileVersion.version))
+        .limit(1)
+    )
+    latest = result.first()
     share = FileShare(
         file_path=file_path,
         token=uuid.uuid4().hex,
         is_public=False,
         is_archived=False,
+        latest_version_id=latest.id if latest else None,
+        is_tombstoned=bool(latest and latest.is_delete),
         created_by_id=user.id,
     )
     db.add(share)
@@ -40,6 +125,16 @@ async def _get_or_create_share(db: AsyncSession, file_path: str, user: User) ->
     return share
 
 
+async def _commit_share(db: AsyncSession, share: FileShare):
+    """Commit a share change, then drop its cached public-link state.
+
+    Invalidating only after the commit means a concurrent public request
+    cannot re-cache the old state for the rest of the TTL.
+    """
+    await db.commit()
+    invalidate_share_cache(share)
+
+
 @router.get("/share-info")
 async def share_info(
     path: str = Query(...),
@@ -67,8 +162,8 @@ async def share_info(
         "is_public": share.is_public,
         "is_archived": share.is_archived,
         "token": share.token,
-        # public raw URL is path-based (encode segments so slashes remain separators)
-        "public_url": ("/public/raw/" + "/".join([quote(p) for p in share.file_path.split("/")])) if share.is_public else None,
+        # public raw URL is path-based (slashes stay unescaped as separators)
+        "public_url": ("/public/raw/" + quote(share.file_path, safe="/")) if share.is_public else None,
         "bucket_url": bucket_url,
     }
 
@@ -84,7 +179,7 @@ async def toggle_public(
     share = await _get_or_create_share(db, path, user)
     share.is_public = not share.is_public
 
-    db.add(AuditLog(
+    log_after_commit(db, AuditLog(
         user_id=user.id,
         action="file.toggle_public",
         resource_type="file",
@@ -92,13 +187,14 @@ async def toggle_public(
         details={"is_public": share.is_public, "token": share.token},
         ip_address=request.client.host if request and request.client else "",
     ))
+    await _commit_share(db, share)
 
     bucket_url = S3Service.get_public_bucket_url(path)
 
     return {
         "is_public": share.is_public,
         "token": share.token,
-        "public_url": ("/public/raw/" + "/".join([quote(p) for p in share.file_path.split("/")])) if share.is_public else None,
+        "public_url": ("/public/raw/" + quote(share.file_path, safe="/")) if share.is_public else None,
         "bucket_url": bucket_url,
     }
 
@@ -114,7 +210,7 @@ async def toggle_archive(
     share = await _get_or_create_share(db, path, user)
     share.is_archived = not share.is_archived
 
-    db.add(AuditLog(
+    log_after_commit(db, AuditLog(
         user_id=user.id,
         action="file.toggle_archive",
         resource_type="file",
@@ -122,6 +218,7 @@ async def toggle_archive(
         details={"is_archived": share.is_archived},
         ip_address=request.client.host if request and request.client else "",
     ))
+    await _commit_share(db, share)
 
     return {
         "is_archived": share.is_archived,
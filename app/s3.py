@@ -3,18 +3,19 @@
 Works with AWS S3, MinIO, Cloudflare R2, and any S3-compatible endpoint.
 """
 
+import asyncio
 import hashlib
 import uuid
+from contextlib import AsyncExitStack, asynccontextmanager
 from io import BytesIO
-from typing import Optional
+from types import MappingProxyType
+from typing import AsyncIterator, Optional
 
 import aioboto3
 import aiohttp
 from botocore.config import Config as BotoConfig
 
-from app.config import get_settings
-
-settings = get_settings()
+from app.config import settings
 
 
 def _get_session():
@@ -32,6 +33,8 @@ def _client_kwargs():
             signature_version="s3v4",
             s3={"addressing_style": "path"},
             retries={"max_attempts": 3, "mode": "adaptive"},
+            # Wide enough for concurrent staging of a whole folder
+            max_pool_connections=64,
             connect_timeout=30,
             read_timeout=60,
         ),
@@ -41,6 +44,48 @@ def _client_kwargs():
     return kwargs
 
 
+# Long-lived client opened by S3Service.start(); reusing it keeps the
+# endpoint resolution, signer and aiohttp connection pool (and with it
+# TCP/TLS keep-alive to S3) across requests.
+_client = None
+_client_stack: Optional[AsyncExitStack] = None
+
+
+@asynccontextmanager
+async def _get_client():
+    if _client is not None:
+        yield _client
+        return
+    # Not started (scripts, tests): fall back to a throwaway client
+    async with _get_session().client("s3", **_client_kwargs()) as client:
+        yield client
+
+
+_CONTENT_TYPES = MappingProxyType({
+    "html": "text/html", "css": "text/css", "js": "application/javascript",
+    "json": "application/json", "xml": "application/xml", "yaml": "text/yaml",
+    "yml": "text/yaml", "md": "text/markdown", "txt": "text/plain",
+    "py": "text/x-python", "rb": "text/x-ruby", "go": "text/x-go",
+    "rs": "text/x-rust", "java": "text/x-java", "ts": "text/typescript",
+    "tsx": "text/typescript", "jsx": "text/javascript", "sh": "text/x-shellscript",
+    "sql": "text/x-sql", "csv": "text/csv", "svg": "image/svg+xml",
+    "png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg",
+    "gif": "image/gif", "pdf": "application/pdf", "zip": "application/zip",
+    "tar": "application/x-tar", "gz": "application/gzip",
+})
+
+# Classified once here so is_text_file is a single set lookup per path
+_TEXT_EXTS = frozenset(
+    ext for ext, ct in _CONTENT_TYPES.items()
+    if ct.startswith("text/") or ct in ("application/json", "application/javascript", "application/xml")
+)
+
+
+def _extension(path: str) -> str:
+    _, dot, ext = path.rpartition(".")
+    return ext.lower() if dot else ""
+
+
 def _prefixed(key: str) -> str:
     if settings.s3_prefix:
         return f"{settings.s3_prefix.rstrip('/')}/{key}"
@@ -58,10 +103,27 @@ def _unprefix(key: str) -> str:
 class S3Service:
     """Async S3-compatible storage operations."""
 
+    @staticmethod
+    async def start():
+        """Open the shared client; called once from the app lifespan."""
+        global _client, _client_stack
+        if _client is not None:
+            return
+        stack = AsyncExitStack()
+        _client = await stack.enter_async_context(_get_session().client("s3", **_client_kwargs()))
+        _client_stack = stack
+
+    @staticmethod
+    async def stop():
+        global _client, _client_stack
+        if _client_stack is not None:
+            _client = None
+            await _client_stack.aclose()
+            _client_stack = None
+
     @staticmethod
     async def ensure_bucket():
-        session = _get_session()
-        async with session.client("s3", **_client_kwargs()) as client:
+        async with _get_client() as client:
             try:
                 await client.head_bucket(Bucket=settings.s3_bucket)
             except Exception:
@@ -71,8 +133,7 @@ class S3Service:
     async def put_object(key: str, content: bytes, content_type: str = "application/octet-stream") -> str:
         """Upload content and return the S3 key."""
         full_key = _prefixed(key)
-        session = _get_session()
-        async with session.client("s3", **_client_kwargs()) as client:
+        async with _get_client() as client:
             await client.put_object(
                 Bucket=settings.s3_bucket,
                 Key=full_key,
@@ -81,42 +142,106 @@ class S3Service:
             )
         return full_key
 
+    @staticmethod
+    async def upload_fileobj(key: str, fileobj, content_type: str = "application/octet-stream") -> str:
+        """Stream a file-like object to S3 in chunks (multipart when large) and return the S3 key."""
+        full_key = _prefixed(key)
+        async with _get_client() as client:
+            await client.upload_fileobj(
+                fileobj, settings.s3_bucket, full_key,
+                ExtraArgs={"ContentType": content_type},
+            )
+        return full_key
+
     @staticmethod
     async def get_object(key: str) -> bytes:
         """Download and return object content."""
         full_key = _prefixed(key)
-        session = _get_session()
-        async with session.client("s3", **_client_kwargs()) as client:
+        async with _get_client() as client:
             resp = await client.get_object(Bucket=settings.s3_bucket, Key=full_key)
             data = await resp["Body"].read()
         return data
 
+    @staticmethod
+    async def open_object(key: str, chunk_size: int = 64 * 1024) -> tuple[int, AsyncIterator[bytes]]:
+        """Start downloading an object and return (size, chunk iterator).
+
+        The GET is issued before returning, so a missing key raises here
+        rather than after a response has started. Only one chunk is held in
+        memory at a time; the iterator must be consumed or closed.
+        """
+        full_key = _prefixed(key)
+        stack = AsyncExitStack()
+        client = await stack.enter_async_context(_get_client())
+        try:
+            resp = await client.get_object(Bucket=settings.s3_bucket, Key=full_key)
+        except BaseException:
+            await stack.aclose()
+            raise
+        body = resp["Body"]
+
+        async def _chunks():
+            try:
+                async for chunk in body.iter_chunks(chunk_size):
+                    yield chunk
+            finally:
+                body.close()
+                await stack.aclose()
+
+        return resp["ContentLength"], _chunks()
+
+    @staticmethod
+    async def presign_get(key: str, expires: int = 300, filename: Optional[str] = None) -> str:
+        """Presigned GET URL for an object, optionally served as an attachment."""
+        params = {"Bucket": settings.s3_bucket, "Key": _prefixed(key)}
+        if filename:
+            params["ResponseContentDisposition"] = f'attachment; filename="{filename}"'
+        async with _get_client() as client:
+            return await client.generate_presigned_url("get_object", Params=params, ExpiresIn=expires)
+
+    @staticmethod
+    async def get_objects_batch(keys: list[str], concurrency: int = 32, return_exceptions: bool = False) -> list:
+        """Download several objects in parallel, preserving order.
+
+        At most `concurrency` GETs are in flight at once. With
+        `return_exceptions`, failed keys yield their exception instead of
+        aborting the whole batch.
+        """
+        semaphore = asyncio.Semaphore(concurrency)
+
+        async def _get(key: str) -> bytes:
+            async with semaphore:
+                return await S3Service.get_object(key)
+
+        return await asyncio.gather(*(_get(k) for k in keys), return_exceptions=return_exceptions)
+
     @staticmethod
     async def delete_object(key: str):
         full_key = _prefixed(key)
-        session = _get_session()
-        async with session.client("s3", **_client_kwargs()) as client:
+        async with _get_client() as client:
             await client.delete_object(Bucket=settings.s3_bucket, Key=full_key)
 
     @staticmethod
-    async def delete_objects(keys: list[str]):
+    async def delete_objects(keys: list[str], concurrency: int = 8):
         if not keys:
             return
-        session = _get_session()
-        async with session.client("s3", **_client_kwargs()) as client:
-            objects = [{"Key": _prefixed(k)} for k in keys]
-            # S3 delete_objects supports max 1000 keys per request
-            for i in range(0, len(objects), 1000):
-                batch = objects[i:i + 1000]
-                await client.delete_objects(
-                    Bucket=settings.s3_bucket,
-                    Delete={"Objects": batch, "Quiet": True},
-                )
+        objects = [{"Key": _prefixed(k)} for k in keys]
+        semaphore = asyncio.Semaphore(concurrency)
+        async with _get_client() as client:
+
+            async def _delete(batch: list[dict]):
+                async with semaphore:
+                    await client.delete_objects(
+                        Bucket=settings.s3_bucket,
+                        Delete={"Objects": batch, "Quiet": True},
+                    )
+
+            # S3 delete_objects supports max 1000 keys per request; send the batches concurrently
+            await asyncio.gather(*(_delete(objects[i:i + 1000]) for i in range(0, len(objects), 1000)))
 
     @staticmethod
     async def copy_object(src_key: str, dst_key: str):
-        session = _get_session()
-        async with session.client("s3", **_client_kwargs()) as client:
+        async with _get_client() as client:
             await client.copy_object(
                 Bucket=settings.s3_bucket,
                 CopySource={"Bucket": settings.s3_bucket, "Key": _prefixed(src_key)},
@@ -130,12 +255,14 @@ class S3Service:
         Returns dict with 'files' (list of object info) and 'folders' (list of common prefixes).
         """
         full_prefix = _prefixed(prefix)
-        session = _get_session()
         files = []
         folders = []
-        async with session.client("s3", **_client_kwargs()) as client:
+        async with _get_client() as client:
             paginator = client.get_paginator("list_objects_v2")
-            params = {"Bucket": settings.s3_bucket, "Prefix": full_prefix}
+            params = {
+                "Bucket": settings.s3_bucket, "Prefix": full_prefix,
+                "PaginationConfig": {"PageSize": 1000},
+            }
             if delimiter:
                 params["Delimiter"] = delimiter
             async for page in paginator.paginate(**params):
@@ -149,11 +276,25 @@ class S3Service:
                     folders.append(_unprefix(cp["Prefix"]))
         return {"files": files, "folders": folders}
 
+    @staticmethod
+    async def list_objects_tree(prefix: str) -> list[dict]:
+        """List every object under `prefix` (which should end in '/').
+
+        The top level is listed with a delimiter first, then each
+        sub-prefix is paginated concurrently, so deep folders do not pay
+        one round-trip per 1000 keys in series.
+        """
+        top = await S3Service.list_objects(prefix=prefix, delimiter="/")
+        subtrees = await asyncio.gather(*(S3Service.list_objects(prefix=folder) for folder in top["folders"]))
+        files = top["files"]
+        for sub in subtrees:
+            files.extend(sub["files"])
+        return files
+
     @staticmethod
     async def head_object(key: str) -> Optional[dict]:
         full_key = _prefixed(key)
-        session = _get_session()
-        async with session.client("s3", **_client_kwargs()) as client:
+        async with _get_client() as client:
             try:
                 resp = await client.head_object(Bucket=settings.s3_bucket, Key=full_key)
                 return {
@@ -174,34 +315,28 @@ class S3Service:
         """Generate a unique S3 key for a staged CR file."""
         return f"_staging/{uuid.uuid4().hex}"
 
+    @staticmethod
+    def content_staging_key(cr_id: int, path: str, content: bytes) -> str:
+        """Content-addressed staging key for a file in a CR.
+
+        Scoped to the CR and path so cleanup of one entry can never remove
+        an object another entry still points at.
+        """
+        path_digest = hashlib.sha256(path.encode("utf-8")).hexdigest()[:16]
+        return f"_staging/{cr_id}/{path_digest}/{S3Service.compute_hash(content)}"
+
     @staticmethod
     def compute_hash(content: bytes) -> str:
+        """SHA-256 hex digest, as stored in FileVersion.content_hash."""
         return hashlib.sha256(content).hexdigest()
 
     @staticmethod
     def guess_content_type(path: str) -> str:
-        ext = path.rsplit(".", 1)[-1].lower() if "." in path else ""
-        mapping = {
-            "html": "text/html", "css": "text/css", "js": "application/javascript",
-            "json": "application/json", "xml": "application/xml", "yaml": "text/yaml",
-            "yml": "text/yaml", "md": "text/markdown", "txt": "text/plain",
-            "py": "text/x-python", "rb": "text/x-ruby", "go": "text/x-go",
-            "rs": "text/x-rust", "java": "text/x-java", "ts": "text/typescript",
-            "tsx": "text/typescript", "jsx": "text/javascript", "sh": "text/x-shellscript",
-            "sql": "text/x-sql", "csv": "text/csv", "svg": "image/svg+xml",
-            "png": "image/png", "jpg": "image/jpeg", "jpeg": "image/jpeg",
-            "gif": "image/gif", "pdf": "application/pdf", "zip": "application/zip",
-            "tar": "application/x-tar", "gz": "application/gzip",
-        }
-        return mapping.get(ext, "application/octet-stream")
+        return _CONTENT_TYPES.get(_extension(path), "application/octet-stream")
 
     @staticmethod
     def is_text_file(path: str) -> bool:
-        ct = S3Service.guess_content_type(path)
-        return ct.startswith("text/") or ct in (
-            "application/json", "application/javascript", "application/xml",
-            "application/x-yaml", "text/markdown", "text/x-python",
-        )
+        return _extension(path) in _TEXT_EXTS
 
     @staticmethod
     def get_public_bucket_url(key: str) -> str | None:
@@ -95,6 +95,43 @@ const Vault = {
         return `<span class="badge badge-role-${role}">${role}</span>`;
     },
 
+    escapeHtml(text) {
+        return text.replace(/&/g, '&amp;').replace(/</g, '&lt;').replace(/>/g, '&gt;').replace(/"/g, '&quot;');
+    },
+
+    // ── Unified diff renderer ───────────────────────────────────────────
+    renderUnifiedDiff(text) {
+        if (!text) return '<div class="p-3 text-muted">No changes</div>';
+        let html = '<table><tbody>';
+        let oldNo = 0, newNo = 0, inHunk = false;
+        for (const line of text.split('\n')) {
+            const hunk = line.match(/^@@ -(\d+)(?:,\d+)? \+(\d+)(?:,\d+)? @@/);
+            if (hunk) {
+                inHunk = true;
+                oldNo = parseInt(hunk[1], 10);
+                newNo = parseInt(hunk[2], 10);
+                html += `<tr><td class="diff_hunk" colspan="3">${Vault.escapeHtml(line)}</td></tr>`;
+                continue;
+            }
+            // ---/+++ are file headers only before the first hunk; inside one,
+            // a removed "--" or added "++" line starts the same way
+            if (!inHunk || line.startsWith('\\')) {
+                if (line) html += `<tr><td class="diff_hunk" colspan="3">${Vault.escapeHtml(line)}</td></tr>`;
+                continue;
+            }
+            const body = Vault.escapeHtml(line.slice(1));
+            const mark = line[0];
+            if (mark === '+') {
+                html += `<tr><td class="diff_header"></td><td class="diff_header">${newNo++}</td><td class="diff_add">${body}</td></tr>`;
+            } else if (mark === '-') {
+                html += `<tr><td class="diff_header">${oldNo++}</td><td class="diff_header"></td><td class="diff_sub">${body}</td></tr>`;
+            } else if (mark === ' ') {
+                html += `<tr><td class="diff_header">${oldNo++}</td><td class="diff_header">${newNo++}</td><td>${body}</td></tr>`;
+            }
+        }
+        return html + '</tbody></table>';
+    },
+
     // ── File icon ───────────────────────────────────────────────────────
     fileIcon(name, isFolder) {
         if (isFolder) {
@@ -473,7 +510,7 @@ async function viewCRDiff(crId, fileId) {
     container.innerHTML = '<div class="loading-spinner"><div class="spinner-border spinner-border-sm me-2"></div> Loading diff...</div>';
     try {
         const data = await Vault.api(`/api/cr/${crId}/diff/${fileId}`);
-        container.innerHTML = `<div class="card"><div class="card-header">${Vault.actionBadge(data.action)} ${data.file_path}</div><div class="card-body p-0"><div class="diff-container">${data.diff_html}</div></div></div>`;
+        container.innerHTML = `<div class="card"><div class="card-header">${Vault.actionBadge(data.action)} ${data.file_path}</div><div class="card-body p-0"><div class="diff-container">${Vault.renderUnifiedDiff(data.diff)}</div></div></div>`;
     } catch (err) {
         container.innerHTML = `<div class="alert alert-danger">${err.message}</div>`;
     }
@@ -9,5 +9,6 @@ if __name__ == "__main__":
         host="0.0.0.0",
         port=8000,
         reload=True,
+        loop="uvloop",
         log_level="info",
     )
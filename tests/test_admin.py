@@ -0,0 +1,119 @@
+"""Keyset pagination on the admin list endpoints."""
+
+import asyncio
+from datetime import datetime, timedelta
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+import httpx
+from fastapi import Depends, FastAPI
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app import auth, database
+from app.models import AuditLog, User
+from app.routers import admin
+
+T0 = datetime(2024, 1, 1)
+
+
+def _run(monkeypatch, rows, requests):
+    """Seed `rows`, then call `requests(client)` against the admin router."""
+    engine = create_async_engine(
+        "sqlite+aiosqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False},
+    )
+    monkeypatch.setattr(database, "async_session", async_sessionmaker(engine, expire_on_commit=False))
+
+    async def plain_db(db: AsyncSession = Depends(database.get_db)):
+        # SQLite has no REPEATABLE READ; the snapshot only matters on Postgres
+        return db
+
+    app = FastAPI()
+    app.include_router(admin.router)
+    app.dependency_overrides[auth.get_current_user] = lambda: User(id=1, username="admin", role="admin")
+    app.dependency_overrides[database.get_read_only_db] = plain_db
+
+    async def scenario():
+        async with engine.begin() as conn:
+            await conn.run_sync(User.__table__.create)
+            await conn.run_sync(AuditLog.__table__.create)
+        async with database.async_session() as session:
+            session.add_all(rows)
+            await session.commit()
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            result = await requests(client)
+        await engine.dispose()
+        return result
+
+    return asyncio.run(scenario())
+
+
+async def _walk(client, url, per_page):
+    """Follow next_cursor from the first page to the last; return item ids per page."""
+    pages, params = [], {"per_page": per_page}
+    while True:
+        resp = await client.get(url, params=params)
+        assert resp.status_code == 200
+        body = resp.json()
+        pages.append([item["id"] for item in body["items"]])
+        if body["next_cursor"] is None:
+            return pages
+        params = {"per_page": per_page, **body["next_cursor"]}
+
+
+def _users():
+    # Ids 2 and 3 share a timestamp across a page boundary, so the id
+    # tie-break decides whether a row is skipped or repeated
+    offsets = {1: 0, 2: 1, 3: 1, 4: 2, 5: 3}
+    return [
+        User(id=i, username=f"u{i}", email=f"u{i}@example.com", password_hash="x",
+             role="editor", created_at=T0 + timedelta(minutes=m))
+        for i, m in offsets.items()
+    ]
+
+
+def _logs():
+    offsets = {1: 0, 2: 1, 3: 1, 4: 2, 5: 3, 6: 4}
+    return [
+        AuditLog(id=i, action="file.upload" if i % 2 else "auth.login", resource_type="file",
+                 created_at=T0 + timedelta(minutes=m))
+        for i, m in offsets.items()
+    ]
+
+
+def test_list_users_cursor_visits_every_row_once(monkeypatch):
+    pages = _run(monkeypatch, _users(), lambda c: _walk(c, "/api/admin/users", 2))
+    assert pages == [[1, 2], [3, 4], [5]]
+
+
+def test_list_audit_logs_cursor_visits_every_row_once(monkeypatch):
+    pages = _run(monkeypatch, _logs(), lambda c: _walk(c, "/api/admin/audit-logs", 4))
+    assert pages == [[6, 5, 4, 3], [2, 1]]
+
+
+def test_include_total(monkeypatch):
+    async def requests(client):
+        plain = await client.get("/api/admin/audit-logs", params={"per_page": 1})
+        counted = await client.get(
+            "/api/admin/audit-logs", params={"per_page": 1, "include_total": True, "action": "file.upload"},
+        )
+        return plain.json(), counted.json()
+
+    plain, counted = _run(monkeypatch, _logs(), requests)
+    assert plain["total"] is None
+    assert counted["total"] == 3
+    assert [item["id"] for item in counted["items"]] == [5]
+
+
+@pytest.mark.parametrize("url", ["/api/admin/users", "/api/admin/audit-logs"])
+@pytest.mark.parametrize("params", [{"after_id": 3}, {"after_created_at": T0.isoformat()}])
+def test_partial_cursor_is_rejected(monkeypatch, url, params):
+    async def requests(client):
+        return await client.get(url, params=params)
+
+    resp = _run(monkeypatch, [], requests)
+    assert resp.status_code == 400
@@ -0,0 +1,56 @@
+"""Cached users must survive a rolled-back request in the same worker."""
+
+import asyncio
+
+import pytest
+
+pytest.importorskip("aiosqlite")
+
+import httpx
+from fastapi import Depends, FastAPI, HTTPException
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
+from sqlalchemy.pool import StaticPool
+
+from app import auth, database
+from app.models import User
+
+
+def test_cached_user_survives_error_response(monkeypatch):
+    engine = create_async_engine(
+        "sqlite+aiosqlite://", poolclass=StaticPool, connect_args={"check_same_thread": False},
+    )
+    # get_db reads the module-level factory, so it now yields SQLite sessions
+    monkeypatch.setattr(database, "async_session", async_sessionmaker(engine, expire_on_commit=False))
+    auth._user_cache.clear()
+
+    async def current_user(db: AsyncSession = Depends(database.get_db)) -> User:
+        return await auth._load_active_user(db, 1)
+
+    app = FastAPI()
+
+    @app.get("/ok")
+    async def ok(user: User = Depends(current_user)):
+        return {"username": user.username, "role": user.role}
+
+    @app.get("/notfound")
+    async def notfound(user: User = Depends(current_user)):
+        raise HTTPException(404, "Not found")
+
+    async def scenario():
+        async with engine.begin() as conn:
+            await conn.run_sync(User.__table__.create)
+        async with database.async_session() as session:
+            session.add(User(id=1, username="alice", email="a@example.com", password_hash="x", role="editor"))
+            await session.commit()
+
+        transport = httpx.ASGITransport(app=app)
+        async with httpx.AsyncClient(transport=transport, base_url="http://test") as client:
+            assert (await client.get("/ok")).status_code == 200
+            assert (await client.get("/notfound")).status_code == 404
+            resp = await client.get("/ok")
+        await engine.dispose()
+        return resp
+
+    resp = asyncio.run(scenario())
+    assert resp.status_code == 200
+    assert resp.json() == {"username": "alice", "role": "editor"}
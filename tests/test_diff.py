@@ -0,0 +1,25 @@
+"""Unified diffs returned for CR files."""
+
+import pytest
+
+pytest.importorskip("fastapi")
+
+from app.routers.change_requests import _unified_diff
+
+
+def test_file_headers_come_before_first_hunk():
+    diff = _unified_diff(["a", "b"], ["a", "c"], "a/notes.txt", "b/notes.txt").split("\n")
+    assert diff[:3] == ["--- a/notes.txt", "+++ b/notes.txt", "@@ -1,2 +1,2 @@"]
+    assert diff[3:] == [" a", "-b", "+c"]
+
+
+def test_content_lines_can_look_like_headers():
+    # Removing "-- x" / adding "++ y" yields "--- x" / "+++ y" inside the
+    # hunk; the browser renderer must not treat those as file headers
+    diff = _unified_diff(["-- x"], ["++ y"], "a/q.sql", "b/q.sql").split("\n")
+    hunk = diff[diff.index("@@ -1 +1 @@") + 1:]
+    assert hunk == ["--- x", "+++ y"]
+
+
+def test_identical_files_produce_empty_diff():
+    assert _unified_diff(["same"], ["same"], "a/f", "b/f") == ""
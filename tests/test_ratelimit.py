@@ -0,0 +1,56 @@
+"""Sliding-window limiter used by login and registration."""
+
+import pytest
+
+pytest.importorskip("cachetools")
+
+from fastapi import HTTPException
+
+from app import ratelimit
+from app.ratelimit import SlidingWindowLimiter
+
+
+@pytest.fixture
+def clock(monkeypatch):
+    now = [1000.0]
+    monkeypatch.setattr(ratelimit.time, "monotonic", lambda: now[0])
+    return now
+
+
+def test_rejects_once_window_is_full(clock):
+    limiter = SlidingWindowLimiter(limit=3, period=60)
+    for _ in range(3):
+        limiter.hit("1.2.3.4")
+        clock[0] += 10
+
+    with pytest.raises(HTTPException) as exc:
+        limiter.hit("1.2.3.4")
+    assert exc.value.status_code == 429
+    # The oldest hit (t=1000) leaves the window at t=1060; now is 1030
+    assert exc.value.headers["Retry-After"] == "30"
+
+
+def test_window_slides_instead_of_resetting(clock):
+    limiter = SlidingWindowLimiter(limit=2, period=60)
+    limiter.hit("k")
+    clock[0] += 50
+    limiter.hit("k")
+
+    clock[0] += 11  # first hit has aged out, second has not
+    limiter.hit("k")
+    with pytest.raises(HTTPException):
+        limiter.hit("k")
+
+
+def test_keys_are_independent(clock):
+    limiter = SlidingWindowLimiter(limit=1, period=60)
+    limiter.hit(("login", "alice"))
+    limiter.hit(("login", "bob"))
+    with pytest.raises(HTTPException):
+        limiter.hit(("login", "alice"))
+
+
+def test_zero_limit_disables(clock):
+    limiter = SlidingWindowLimiter(limit=0, period=60)
+    for _ in range(100):
+        limiter.hit("k")